@@ -1,10 +1,13 @@
+from api.utils.http import http_clients
+
 class ChatBaseProvider:
-    def __init__(self, module_name, stream: bool, models: list, working: bool, limit: int = None):
+    def __init__(self, module_name, stream: bool, models: list, working: bool, limit: int = None, max_concurrency: int = None):
         self.module_name = module_name
         self.stream = stream
         self.models = models
         self.working = working
         self.limit = limit
+        self.max_concurrency = max_concurrency # requests the upstream accepts at once, None for no cap
 
     async def generate_completion(self, data: dict):
         pass
@@ -13,4 +16,8 @@ class ChatBaseProvider:
         raise NotImplementedError("Providers must implement the `generate` method.")
     
     def check(self, data):
-        return True
\ No newline at end of file
+        return True
+
+    def session(self, name: str = None):
+        """A pooled aiohttp session shared by every request of this provider, or the one called `name`."""
+        return http_clients.session(name or self.__class__.__name__)
\ No newline at end of file
@@ -3,5 +3,8 @@ from .db_config import db
 from .providers import ProviderManager
 from .users import DatabaseManager
 from .models import ModelManager
+from .cache import user_cache
+from .accounting import accounting
+from .ips import ip_tracker
 
-__all__ = ['db', 'DatabaseManager', 'ProviderManager', 'ModelManager']
+__all__ = ['db', 'DatabaseManager', 'ProviderManager', 'ModelManager', 'user_cache', 'accounting', 'ip_tracker']
@@ -0,0 +1,296 @@
+from datetime import date, datetime
+from pathlib import Path
+import asyncio
+import fcntl
+import ujson
+import uuid
+import os
+
+from pymongo import InsertOne, UpdateOne
+
+from api.config import config
+from .db_config import db
+
+JOURNAL_DIR = Path(getattr(config, 'accounting_journal_dir', 'data/accounting'))
+FLUSH_INTERVAL: int = getattr(config, 'accounting_flush_interval', 1000)  # milliseconds
+FLUSH_EVENTS: int = getattr(config, 'accounting_flush_events', 1000)
+
+# datetime fields of activity_log entries, stored as ISO strings in the journal
+DATETIME_FIELDS = ("timestamp", "expires_at")
+# names this process's journal segments, pids come back after a container restart
+BOOT_ID = uuid.uuid4().hex
+
+def _add(target: dict, increments: dict) -> None:
+    for path, value in increments.items():
+        target[path] = target.get(path, 0) + value
+
+def _try_lock(handle) -> bool:
+    try:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+def _same_file(handle, path: Path) -> bool:
+    """False if the path was unlinked (or replaced) after the handle was opened."""
+    try:
+        return os.stat(path).st_ino == os.fstat(handle.fileno()).st_ino
+    except FileNotFoundError:
+        return False
+
+class AccountingBuffer:
+    """Write-behind buffer for the per-request usage writes.
+
+    Counters are summed in memory and written every FLUSH_INTERVAL ms, or sooner once
+    FLUSH_EVENTS events are buffered, with one unordered bulk_write per collection.
+    Every event is appended to a local journal before it is buffered. Journal writes go
+    through the file's own buffer, each flush rotates to a new segment and fsyncs the
+    old one before writing to Mongo, and deletes the segments it covered once its writes
+    succeed. Events since the last flush (at most FLUSH_INTERVAL ms) can be lost if the
+    process or the machine crashes; everything older survives both. A worker holds an flock on
+    each of its segments until then, so segments nobody holds a lock on were left behind
+    by a dead worker and are replayed on startup. Usage is counted at least once: a crash
+    in the middle of a flush can count that flush twice but never drops it.
+    """
+    def __init__(self, journal_dir: Path = JOURNAL_DIR):
+        self.journal_dir = journal_dir
+        self._usage: dict[str, dict[str, int]] = {}  # {user_id: {path: delta}} for user_usage
+        self._models: dict[tuple[str, str], dict[str, int]] = {}  # {(model, date): {path: delta}} for model_usage
+        self._model_users: dict[tuple[str, str], int] = {}  # {(model, user_id): delta} for model_users
+        self._providers: dict[tuple[str, str], int] = {}  # {(provider, date): delta} for provider_usage
+        self._activity: dict[str, dict] = {}  # {user_id: {"$set": {...}, "$inc": {...}}} for user_activity
+        self._inserts: list[dict] = []  # activity_log entries
+        self._events = 0
+
+        self._journal = None
+        self._segment = 0
+        self._segments: dict[Path, object] = {}  # journal files covering the buffered events, with the open handle holding their lock
+        self._lock = asyncio.Lock()
+        self._full = asyncio.Event()
+
+    def add_usage(self, user_id: str, increments: dict[str, int]) -> None:
+        """Buffers $inc deltas for a user's user_usage document."""
+        if user_id and increments:
+            self._record({"type": "usage", "user_id": user_id, "inc": increments})
+
+    def add_model_usage(self, model: str, user_id: str | None = None, usage: int = 0, input_tokens: int | None = None, output_tokens: int | None = None) -> None:
+        """Buffers usage and token deltas for a model's model_usage document of today."""
+        increments = {}
+        if usage:
+            increments["usage"] = usage
+        if input_tokens:
+            increments["tokens.input"] = input_tokens
+        if output_tokens:
+            increments["tokens.output"] = output_tokens
+
+        if model and increments:
+            self._record({"type": "model", "model": model, "date": date.today().isoformat(), "user_id": user_id, "inc": increments})
+
+    def add_provider_usage(self, provider: str, usage: int = 1) -> None:
+        """Buffers a call to a provider for its provider_usage document of today."""
+        if provider and usage:
+            self._record({"type": "provider", "provider": provider, "date": date.today().isoformat(), "usage": usage})
+
+    def add_activity(self, user_id: str, entry: dict, set_fields: dict, increments: dict) -> None:
+        """Buffers an activity_log entry and the matching user_activity summary update."""
+        entry = {**entry, **{field: entry[field].isoformat() for field in DATETIME_FIELDS if field in entry}}
+        self._record({"type": "activity", "user_id": user_id, "entry": entry, "set": set_fields, "inc": increments})
+
+    def _record(self, event: dict) -> None:
+        try:
+            if self._journal is None:
+                self._open_segment()
+            self._journal.write(ujson.dumps(event) + "\n")
+        except Exception as e:
+            print(f"Error writing accounting journal: {e}")
+
+        self._apply(event)
+        if self._events >= FLUSH_EVENTS:
+            self._full.set()
+
+    def _apply(self, event: dict) -> None:
+        if event["type"] == "usage":
+            _add(self._usage.setdefault(event["user_id"], {}), event["inc"])
+        elif event["type"] == "model":
+            _add(self._models.setdefault((event["model"], event["date"]), {}), event["inc"])
+            if event.get("user_id") and event["inc"].get("usage"):
+                key = (event["model"], event["user_id"])
+                self._model_users[key] = self._model_users.get(key, 0) + event["inc"]["usage"]
+        elif event["type"] == "provider":
+            key = (event["provider"], event["date"])
+            self._providers[key] = self._providers.get(key, 0) + event["usage"]
+        elif event["type"] == "activity":
+            update = self._activity.setdefault(event["user_id"], {"$set": {}, "$inc": {}})
+            update["$set"].update(event["set"])
+            _add(update["$inc"], event["inc"])
+            entry = dict(event["entry"])
+            for field in DATETIME_FIELDS:
+                if field in entry:
+                    entry[field] = datetime.fromisoformat(entry[field])
+            self._inserts.append(entry)
+        self._events += 1
+
+    def _open_segment(self) -> None:
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        self._segment += 1
+        path = self.journal_dir / f"{BOOT_ID}-{self._segment}.jsonl"
+        # locked before it gets its .jsonl name, so replay never picks up a live segment
+        pending = path.with_suffix(".new")
+        journal = open(pending, 'x')
+        fcntl.flock(journal.fileno(), fcntl.LOCK_EX)
+        try:
+            os.link(pending, path)  # unlike a rename, fails if the path already exists
+        finally:
+            pending.unlink()
+        self._journal = journal
+        self._segments[path] = journal
+
+    def _close_segment(self):
+        """Stops writing to the current segment and returns its handle, to be synced."""
+        # the handle stays open in _segments to keep the lock until the segment is flushed
+        journal, self._journal = self._journal, None
+        return journal
+
+    @staticmethod
+    def _sync(journal) -> None:
+        try:
+            journal.flush()
+            os.fsync(journal.fileno())
+        except Exception as e:
+            print(f"Error syncing accounting journal: {e}")
+
+    async def flush(self) -> None:
+        """Writes everything buffered so far, keeping it buffered if a write fails."""
+        async with self._lock:
+            if not self._events:
+                return
+
+            journal = self._close_segment()
+            if journal is not None:
+                await asyncio.to_thread(self._sync, journal)
+            usage, models, model_users, activity, inserts = self._usage, self._models, self._model_users, self._activity, self._inserts
+            providers, segments, events = self._providers, self._segments, self._events
+            self._usage, self._models, self._model_users, self._activity, self._inserts = {}, {}, {}, {}, []
+            self._providers = {}
+            self._segments, self._events = {}, 0
+
+            try:
+                if usage:
+                    await db.user_usage.bulk_write(
+                        [UpdateOne({"user_id": user_id}, {"$inc": increments}, upsert=True) for user_id, increments in usage.items()],
+                        ordered=False
+                    )
+                    usage = {}
+                if activity:
+                    await db.user_activity.bulk_write(
+                        [UpdateOne({"user_id": user_id}, {k: v for k, v in update.items() if v}, upsert=True) for user_id, update in activity.items()],
+                        ordered=False
+                    )
+                    activity = {}
+                if inserts:
+                    await db.activity_log.bulk_write([InsertOne(entry) for entry in inserts], ordered=False)
+                    inserts = []
+                if models:
+                    await db.model_usage.bulk_write(
+                        [UpdateOne({"model": model, "date": day}, {"$inc": increments}, upsert=True) for (model, day), increments in models.items()],
+                        ordered=False
+                    )
+                    models = {}
+                if model_users:
+                    await db.model_users.bulk_write(
+                        [UpdateOne({"model": model, "user_id": user_id}, {"$inc": {"usage": count}}, upsert=True) for (model, user_id), count in model_users.items()],
+                        ordered=False
+                    )
+                    model_users = {}
+                if providers:
+                    await db.provider_usage.bulk_write(
+                        [UpdateOne({"provider": provider, "date": day}, {"$inc": {"usage": count}}, upsert=True) for (provider, day), count in providers.items()],
+                        ordered=False
+                    )
+                    providers = {}
+            except Exception as e:
+                print(f"Error flushing accounting buffer: {e}")
+                # put back whatever wasn't written, the journal still covers it
+                for user_id, increments in usage.items():
+                    _add(self._usage.setdefault(user_id, {}), increments)
+                for user_id, update in activity.items():
+                    current = self._activity.setdefault(user_id, {"$set": {}, "$inc": {}})
+                    current["$set"] = {**update["$set"], **current["$set"]}
+                    _add(current["$inc"], update["$inc"])
+                for key, increments in models.items():
+                    _add(self._models.setdefault(key, {}), increments)
+                for key, count in model_users.items():
+                    self._model_users[key] = self._model_users.get(key, 0) + count
+                for key, count in providers.items():
+                    self._providers[key] = self._providers.get(key, 0) + count
+                self._inserts = inserts + self._inserts
+                self._segments = {**segments, **self._segments}
+                self._events += events
+                return
+
+            # unlinked before the lock is released, so no other worker can replay them
+            for segment, handle in segments.items():
+                try:
+                    segment.unlink()
+                except FileNotFoundError:
+                    pass
+                handle.close()
+
+    async def replay(self) -> int:
+        """Buffers the journal segments left behind by workers that are no longer running and flushes them.
+
+        Returns:
+            int: The number of replayed events.
+        """
+        if not self.journal_dir.exists():
+            return 0
+
+        replayed = 0
+        for path in sorted(self.journal_dir.glob("*.jsonl")):
+            if path in self._segments:
+                continue
+            try:
+                handle = open(path, 'r')
+            except FileNotFoundError:
+                continue
+
+            # a live worker holds the lock, and a segment flushed meanwhile is already unlinked;
+            # the claimed segment stays locked by us until our flush deletes it
+            if not _try_lock(handle) or not _same_file(handle, path):
+                handle.close()
+                continue
+
+            for line in handle:
+                try:
+                    self._apply(ujson.loads(line))
+                    replayed += 1
+                except (ValueError, KeyError):
+                    # the last line may be cut short if the worker died mid write
+                    continue
+            self._segments[path] = handle
+
+        if replayed:
+            print(f"Replaying {replayed} accounting events")
+        await self.flush()
+        return replayed
+
+    async def run(self) -> None:
+        """Flushes every FLUSH_INTERVAL ms, or as soon as FLUSH_EVENTS events are buffered."""
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), FLUSH_INTERVAL / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "events": self._events,
+            "users": len(self._usage),
+            "models": len(self._models),
+            "activity": len(self._inserts),
+            "segments": len(self._segments)
+        }
+
+accounting = AccountingBuffer()
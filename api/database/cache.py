@@ -0,0 +1,135 @@
+from collections import OrderedDict
+from typing import Callable
+import asyncio
+import time
+
+from api.utils.redis_manager import redis
+from api.config import config
+
+INVALIDATION_CHANNEL = "users:invalidate"
+CACHE_SIZE: int = getattr(config, 'user_cache_size', 10000)
+CACHE_TTL: int = getattr(config, 'user_cache_ttl', 60)
+
+def user_identity(user: dict) -> str | None:
+    """A user's user_id, or the key of a legacy user that only has a top-level key."""
+    return user.get("user_id") or user.get("key")
+
+class UserCache:
+    """Bounded LRU cache of auth user documents, looked up by user_id or any of the user's keys.
+
+    Legacy users without a user_id are cached under their key (see `user_identity`).
+
+    Only fields that change through admin or billing writes are cached (subscription, ban,
+    limits, keys). Those writes call `invalidate`, which also tells every other worker over
+    Redis pub/sub. The TTL bounds staleness if an invalidation message is missed.
+    Listeners are called with every invalidated user_id or key, on every worker.
+    """
+    def __init__(self, max_size: int = CACHE_SIZE, ttl: int = CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._users: OrderedDict[str, tuple[float, dict]] = OrderedDict()  # {user_id: (expires, user)}
+        self._aliases: dict[str, str] = {}  # {key or user_id: user_id}
+        self.hits = 0
+        self.misses = 0
+        self.listeners: list[Callable[[str], None]] = []
+
+    def get(self, key_or_id: str) -> dict | None:
+        user_id = self._aliases.get(key_or_id)
+        entry = self._users.get(user_id) if user_id else None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires, user = entry
+        if time.monotonic() > expires:
+            self._evict(user_id)
+            self.misses += 1
+            return None
+
+        self._users.move_to_end(user_id)
+        self.hits += 1
+        return user
+
+    def set(self, user: dict) -> None:
+        user_id = user_identity(user)
+        if not user_id:
+            return
+
+        self._evict(user_id)
+        self._users[user_id] = (time.monotonic() + self.ttl, user)
+        for alias in self.aliases(user):
+            self._aliases[alias] = user_id
+
+        while len(self._users) > self.max_size:
+            oldest, _ = next(iter(self._users.items()))
+            self._evict(oldest)
+
+    async def invalidate(self, user_id: str) -> None:
+        """Drops a user locally and broadcasts the invalidation to the other workers."""
+        if not user_id:
+            return
+
+        self._notify(user_id)
+        try:
+            await redis.publish(INVALIDATION_CHANNEL, user_id)
+        except Exception as e:
+            print(f"Error publishing user cache invalidation: {e}")
+
+    def clear(self) -> None:
+        self._users.clear()
+        self._aliases.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._users),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+    async def listen(self) -> None:
+        """Evicts users invalidated by other workers, reconnecting if Redis drops."""
+        while True:
+            pubsub = redis.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # anything cached while we were disconnected may have missed an invalidation
+                self.clear()
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._notify(message["data"])
+            except asyncio.CancelledError:
+                await pubsub.reset()
+                raise
+            except Exception as e:
+                print(f"User cache invalidation listener error: {e}")
+                await pubsub.reset()
+                self.clear()
+                await asyncio.sleep(1)
+
+    def _notify(self, user_id: str) -> None:
+        self._evict(user_id)
+        for listener in self.listeners:
+            listener(user_id)
+
+    def _evict(self, user_id: str) -> None:
+        entry = self._users.pop(user_id, None)
+        if entry is None:
+            return
+
+        for alias in self.aliases(entry[1]):
+            if self._aliases.get(alias) == user_id:
+                del self._aliases[alias]
+
+    @staticmethod
+    def aliases(user: dict) -> list[str]:
+        """The user_id and every key a user document can be looked up by."""
+        aliases = [user_identity(user)]
+        aliases.extend(k["key"] for k in user.get("keys", []) if k.get("key"))
+        if user.get("key"):
+            aliases.append(user["key"])
+        return aliases
+
+user_cache = UserCache()
@@ -0,0 +1,121 @@
+from datetime import date, datetime, time, timedelta
+import asyncio
+
+from pymongo import UpdateOne
+
+from api.utils.redis_manager import RequestPipeline, redis
+from api.config import config
+from .db_config import db
+
+# keys outlive their day so the last snapshot of a day can still read them
+DAILY_USAGE_TTL: int = getattr(config, 'daily_usage_ttl', 2 * 24 * 60 * 60)
+SNAPSHOT_INTERVAL: int = getattr(config, 'daily_usage_snapshot_interval', 300)
+SNAPSHOT_LOCK = "daily_usage:snapshot_lock"
+
+# KEYS[1] = today's counter, ARGV = cost, limit, ttl
+# returns {allowed, remaining}, the counter is only incremented when the cost fits
+CONSUME_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local cost = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+if current + cost > limit then
+    return {0, limit - current}
+end
+local total = redis.call('INCRBY', KEYS[1], cost)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return {1, limit - total}
+"""
+consume_script = redis.register_script(CONSUME_SCRIPT)
+
+def daily_usage_key(user_id: str, day: str | None = None) -> str:
+    """Redis key holding a user's credits spent on `day` (defaults to today)."""
+    return f"daily_usage:{day or date.today().isoformat()}:{user_id}"
+
+async def get_daily_credits(user_id: str) -> int:
+    """Returns the credits a user has spent today."""
+    try:
+        return int(await redis.get(daily_usage_key(user_id)) or 0)
+    except Exception as e:
+        print(f"Error reading daily usage: {e}")
+        return 0
+
+def seconds_until_reset() -> int:
+    """Seconds until today's counters stop being used, at local midnight."""
+    midnight = datetime.combine(date.today() + timedelta(days=1), time())
+    return max(int((midnight - datetime.now()).total_seconds()), 0)
+
+async def consume_daily_credits(user_id: str, credits: int, limit: int, pipeline: RequestPipeline | None = None) -> tuple[bool, int, int]:
+    """Atomically spends `credits` of a user's daily limit if they fit.
+
+    Args:
+        user_id: The user to charge.
+        credits: The cost of the request.
+        limit: The user's daily credit limit, standard or custom tier.
+        pipeline: Send the script as part of this pipeline.
+
+    Returns:
+        tuple[bool, int, int]: (allowed, remaining credits, seconds until the reset).
+        Allows the request if Redis is unavailable.
+    """
+    reset = seconds_until_reset()
+    try:
+        keys, args = [daily_usage_key(user_id)], [credits, limit, DAILY_USAGE_TTL]
+        if pipeline is not None:
+            allowed, remaining = await pipeline.script(consume_script, keys, args)
+        else:
+            allowed, remaining = await consume_script(keys=keys, args=args)
+        return bool(allowed), max(int(remaining), 0), reset
+    except Exception as e:
+        print(f"Error consuming daily credits: {e}")
+        return True, limit, reset
+
+async def snapshot_daily_usage(day: str | None = None, batch_size: int = 1000) -> int:
+    """Copies a day's Redis counters into user_usage.daily_usage for history.
+
+    Values are $set rather than added, so snapshotting the same day again is harmless.
+
+    Returns:
+        int: The number of users written.
+    """
+    day = day or date.today().isoformat()
+    prefix = f"daily_usage:{day}:"
+
+    written = 0
+    keys = []
+    async for key in redis.scan_iter(match=f"{prefix}*", count=batch_size):
+        keys.append(key)
+        if len(keys) >= batch_size:
+            written += await _write_snapshot(day, prefix, keys)
+            keys = []
+    if keys:
+        written += await _write_snapshot(day, prefix, keys)
+    return written
+
+async def _write_snapshot(day: str, prefix: str, keys: list[str]) -> int:
+    values = await redis.mget(keys)
+    operations = [
+        UpdateOne({"user_id": key[len(prefix):]}, {"$set": {f"daily_usage.{day}": int(value)}}, upsert=True)
+        for key, value in zip(keys, values) if value is not None
+    ]
+    if operations:
+        await db.user_usage.bulk_write(operations, ordered=False)
+    return len(operations)
+
+async def run_snapshots(interval: int = SNAPSHOT_INTERVAL) -> None:
+    """Snapshots today's and yesterday's counters every `interval` seconds.
+
+    Yesterday is included so the final minutes of a day are saved after midnight. Only
+    the worker holding the lock snapshots in a given interval.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if not await redis.set(SNAPSHOT_LOCK, "1", nx=True, ex=max(interval - 1, 1)):
+                continue
+            yesterday = (date.today() - timedelta(days=1)).isoformat()
+            for day in (yesterday, date.today().isoformat()):
+                await snapshot_daily_usage(day)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error snapshotting daily usage: {e}")
@@ -0,0 +1,207 @@
+from datetime import datetime
+import argparse
+import asyncio
+import sys
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import OperationFailure
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from .db_config import db
+
+# required indexes per collection, created on startup by ensure_indexes
+INDEXES: dict[str, list[IndexModel]] = {
+    "usersV2": [
+        # legacy key-only users have no user_id, a plain unique index would count them all as null
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True, partialFilterExpression={"user_id": {"$exists": True}}),
+        # partial instead of sparse, users whose keys were all deleted still have an empty `keys` array
+        IndexModel([("keys.key", ASCENDING)], name="keys_key_unique", unique=True, partialFilterExpression={"keys.key": {"$exists": True}}),
+        IndexModel([("key", ASCENDING)], name="key_unique", unique=True, partialFilterExpression={"key": {"$exists": True}}),
+        IndexModel([("stripe_customer_id", ASCENDING)], name="stripe_customer_id", sparse=True),
+    ],
+    "user_usage": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ],
+    "user_activity": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ],
+    "provider_usage": [
+        IndexModel([("provider", ASCENDING), ("date", ASCENDING)], name="provider_date_unique", unique=True),
+    ],
+    "model_usage": [
+        IndexModel([("model", ASCENDING), ("date", ASCENDING)], name="model_date_unique", unique=True),
+    ],
+    "model_users": [
+        IndexModel([("model", ASCENDING), ("user_id", ASCENDING)], name="model_user_id_unique", unique=True),
+    ],
+    "activity_log": [
+        IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING)], name="user_id_timestamp"),
+        IndexModel([("user_id", ASCENDING), ("action_type", ASCENDING), ("timestamp", DESCENDING)], name="user_id_action_type_timestamp"),
+        # each entry carries its own expiry so retention can differ per tier
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+}
+
+# hot queries from api/database/users.py that must never fall back to a collection scan
+HOT_QUERIES: dict[str, list[dict]] = {
+    "usersV2": [
+        {"$or": [{"user_id": "explain"}, {"keys.key": "explain"}, {"key": "explain"}]},
+        {"user_id": "explain"},
+        {"keys.key": "explain"},
+        {"key": "explain"},
+        {"stripe_customer_id": "explain"},
+    ],
+    "user_usage": [
+        {"user_id": "explain"},
+    ],
+    "user_activity": [
+        {"user_id": "explain"},
+    ],
+    "provider_usage": [
+        {"provider": "explain", "date": "explain"},
+    ],
+    "model_usage": [
+        {"model": "explain", "date": "explain"},
+    ],
+    "model_users": [
+        {"model": "explain", "user_id": "explain"},
+    ],
+    "activity_log": [
+        {"user_id": "explain", "timestamp": {"$lt": datetime(2000, 1, 1)}},
+        {"user_id": "explain", "action_type": "chat"},
+    ],
+}
+
+# read only rollups, {view: (source collection, pipeline)}, created on startup by ensure_views
+VIEWS: dict[str, tuple[str, list[dict]]] = {
+    "model_usage_totals": ("model_usage", [
+        {"$group": {
+            "_id": "$model",
+            "usage": {"$sum": "$usage"},
+            "input_tokens": {"$sum": "$tokens.input"},
+            "output_tokens": {"$sum": "$tokens.output"},
+        }},
+    ]),
+}
+
+class QueryPlanError(Exception):
+    """Raised when a hot query is planned as a collection scan"""
+    def __init__(self, error: str):
+        super().__init__(error)
+        self.error: str = error
+
+async def ensure_indexes(database: AsyncIOMotorDatabase = db) -> list[str]:
+    """Creates any missing indexes from INDEXES and checks the existing ones match.
+
+    Args:
+        database: The database to create the indexes on.
+
+    Returns:
+        list[str]: A list of problems, empty if every index is in place.
+    """
+    problems = []
+
+    for collection, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                await database[collection].create_indexes([index])
+            except OperationFailure as e:
+                # duplicate keys, or an index with the same name but different options
+                problems.append(f"{collection}.{index.document['name']}: {e}")
+
+        existing = await database[collection].index_information()
+        for index in indexes:
+            spec = index.document
+            info = existing.get(spec['name'])
+            if info is None:
+                problems.append(f"{collection}.{spec['name']}: missing")
+            elif info.get('unique', False) != spec.get('unique', False):
+                problems.append(f"{collection}.{spec['name']}: expected unique={spec.get('unique', False)}")
+
+    for problem in problems:
+        print(f"Index problem: {problem}")
+    return problems
+
+async def ensure_views(database: AsyncIOMotorDatabase = db) -> list[str]:
+    """Creates the views in VIEWS, or updates their pipeline if they already exist.
+
+    Args:
+        database: The database to create the views on.
+
+    Returns:
+        list[str]: A list of problems, empty if every view is in place.
+    """
+    problems = []
+    existing = set(await database.list_collection_names(filter={"type": "view"}))
+
+    for view, (source, pipeline) in VIEWS.items():
+        try:
+            if view in existing:
+                await database.command("collMod", view, viewOn=source, pipeline=pipeline)
+            else:
+                await database.create_collection(view, viewOn=source, pipeline=pipeline)
+        except OperationFailure as e:
+            problems.append(f"{view}: {e}")
+
+    for problem in problems:
+        print(f"View problem: {problem}")
+    return problems
+
+def _find_collscans(plan: dict | list) -> list[str]:
+    """Recursively collects the stages of a query plan that scan the whole collection."""
+    stages = []
+
+    if isinstance(plan, list):
+        for child in plan:
+            stages.extend(_find_collscans(child))
+    elif isinstance(plan, dict):
+        if plan.get('stage') == 'COLLSCAN':
+            stages.append(plan.get('filter', {}))
+        for key in ('inputStage', 'inputStages', 'queryPlan', 'winningPlan'):
+            if key in plan:
+                stages.extend(_find_collscans(plan[key]))
+    return stages
+
+async def verify_query_plans(database: AsyncIOMotorDatabase = db) -> None:
+    """Explains every query in HOT_QUERIES and fails if any of them uses a COLLSCAN.
+
+    Args:
+        database: The database to explain the queries against.
+
+    Raises:
+        QueryPlanError: A hot query was planned as a collection scan.
+    """
+    failures = []
+
+    for collection, queries in HOT_QUERIES.items():
+        for query in queries:
+            explanation = await database[collection].find(query).explain()
+            if _find_collscans(explanation.get('queryPlanner', {}).get('winningPlan', {})):
+                failures.append(f"{collection}: {query}")
+
+    if failures:
+        raise QueryPlanError(f"Collection scan in {len(failures)} hot queries: {', '.join(map(str, failures))}")
+
+async def main(uri: str | None, database_name: str | None, verify: bool) -> int:
+    database = db
+    if uri:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        database = AsyncIOMotorClient(uri)[database_name or db.name]
+
+    problems = await ensure_indexes(database) + await ensure_views(database)
+    if verify:
+        try:
+            await verify_query_plans(database)
+        except QueryPlanError as e:
+            print(e.error)
+            return 1
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the required MongoDB indexes and optionally verify query plans.")
+    parser.add_argument("--uri", help="MongoDB uri, defaults to the one in secrets/values.yml")
+    parser.add_argument("--database", help="Database name, defaults to the one in secrets/values.yml")
+    parser.add_argument("--verify", action="store_true", help="Fail if a hot query uses a COLLSCAN")
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(main(args.uri, args.database, args.verify)))
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+import asyncio
+import time
+
+from api.config import config
+from .users import DatabaseManager
+from .cache import user_cache
+
+SEEN_SIZE: int = getattr(config, 'ip_seen_size', 50000)
+SEEN_TTL: int = getattr(config, 'ip_seen_local_ttl', 300)
+
+class IPTracker:
+    """Records the IPs keys are used from without making requests wait.
+
+    Pairs seen recently by this worker are skipped entirely. Anything else is handed to
+    DatabaseManager.add_ip in a background task, which checks Redis before writing to Mongo.
+    An IP reset invalidates the user's keys in the user cache, which makes every worker
+    forget the pairs it saw for them.
+    """
+    def __init__(self, max_size: int = SEEN_SIZE, ttl: int = SEEN_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._seen: OrderedDict[tuple[str, str], float] = OrderedDict()  # {(key, ip): expires}
+        self._tasks: set[asyncio.Task] = set()
+
+    def track(self, key: str, ip: str) -> None:
+        if not key or not ip:
+            return
+
+        expires = self._seen.get((key, ip))
+        if expires is not None and time.monotonic() < expires:
+            return
+
+        self._seen[(key, ip)] = time.monotonic() + self.ttl
+        self._seen.move_to_end((key, ip))
+        while len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+
+        task = asyncio.create_task(self._record(key, ip))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _record(self, key: str, ip: str) -> None:
+        try:
+            await DatabaseManager.add_ip(key, ip)
+        except Exception as e:
+            # forget it so the next request retries
+            self._seen.pop((key, ip), None)
+            print(f"Error recording ip: {e}")
+
+    def forget(self, key: str) -> None:
+        """Drops the pairs seen for a key, so its IPs are recorded again."""
+        for seen in [seen for seen in self._seen if seen[0] == key]:
+            del self._seen[seen]
+
+    async def drain(self) -> None:
+        """Waits for the pending writes, used on shutdown."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+ip_tracker = IPTracker()
+user_cache.listeners.append(ip_tracker.forget)
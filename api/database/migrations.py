@@ -0,0 +1,237 @@
+from datetime import date, datetime, time, timedelta, timezone
+import argparse
+import asyncio
+
+from pymongo import InsertOne, UpdateOne
+
+from .users import USAGE_FIELDS, ACTIVITY_FIELDS, ACTIVITY_RETENTION
+from .db_config import db
+
+def _flatten_counters(data: dict, prefix: str) -> dict[str, int]:
+    """Flattens nested counters into dotted paths, e.g. {"models.gpt-4.tokens.input": 10}."""
+    counters = {}
+    for key, value in data.items():
+        path = f"{prefix}.{key}"
+        if isinstance(value, dict):
+            counters.update(_flatten_counters(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            counters[path] = value
+    return counters
+
+def _usage_update(user: dict) -> dict:
+    """Builds an update that merges a user's legacy usage fields into their user_usage document.
+
+    Counters are added with $inc rather than overwritten, so anything written to the new
+    collection since the deploy is kept.
+    """
+    increments = {}
+    if isinstance(user.get("usage"), (int, float)):
+        increments["usage"] = user["usage"]
+    increments.update(_flatten_counters(user.get("daily_usage") or {}, "daily_usage"))
+    increments.update(_flatten_counters(user.get("models") or {}, "models"))
+
+    ips = user.get("ip") or []
+    if isinstance(ips, str):
+        ips = [ips]
+
+    update = {"$addToSet": {"ip": {"$each": ips[:3]}}}
+    if increments:
+        update["$inc"] = increments
+    return update
+
+def _activity_update(user: dict) -> dict | None:
+    """Builds an update that merges a user's legacy activity fields into their user_activity document."""
+    update = {}
+
+    pushes = {
+        f"recent_activity.{action_type}": {"$each": entries}
+        for action_type, entries in (user.get("recent_activity") or {}).items() if entries
+    }
+    if pushes:
+        update["$push"] = pushes
+
+    counts = _flatten_counters(user.get("model_usage_count") or {}, "model_usage_count")
+    if counts:
+        update["$inc"] = counts
+
+    if user.get("last_activity_date"):
+        update["$max"] = {"last_activity_date": user["last_activity_date"]}
+    if user.get("last_model_used"):
+        update["$setOnInsert"] = {"last_model_used": user["last_model_used"]}
+
+    return update or None
+
+async def split_user_documents(batch_size: int = 500) -> int:
+    """Moves the cold usage and activity fields out of usersV2 into user_usage and user_activity.
+
+    Each batch is merged into the new collections first and only then unset from usersV2,
+    so the migration can be stopped and re-run at any point. If it is killed between
+    those two writes, that last batch is merged a second time on the next run.
+
+    Args:
+        batch_size: How many users to move per bulk write.
+
+    Returns:
+        int: The number of users migrated.
+    """
+    cold_fields = USAGE_FIELDS + ACTIVITY_FIELDS
+    query = {"user_id": {"$exists": True}, "$or": [{field: {"$exists": True}} for field in cold_fields]}
+    projection = {"_id": 1, "user_id": 1, **{field: 1 for field in cold_fields}}
+
+    migrated = 0
+    while True:
+        users = await db.usersV2.find(query, projection).limit(batch_size).to_list(length=batch_size)
+        if not users:
+            return migrated
+
+        usage_ops, activity_ops = [], []
+        for user in users:
+            usage_ops.append(UpdateOne({"user_id": user["user_id"]}, _usage_update(user), upsert=True))
+            activity_update = _activity_update(user)
+            if activity_update:
+                activity_ops.append(UpdateOne({"user_id": user["user_id"]}, activity_update, upsert=True))
+
+        if usage_ops:
+            await db.user_usage.bulk_write(usage_ops, ordered=False)
+        if activity_ops:
+            await db.user_activity.bulk_write(activity_ops, ordered=False)
+
+        await db.usersV2.update_many(
+            {"_id": {"$in": [user["_id"] for user in users]}},
+            {"$unset": {field: "" for field in cold_fields}}
+        )
+
+        migrated += len(users)
+        print(f"Migrated {migrated} users")
+
+def _parse_timestamp(value) -> datetime:
+    """Legacy activity timestamps are ISO dates (or datetimes) stored as strings."""
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        return datetime.now(timezone.utc)
+    if isinstance(parsed, date) and not isinstance(parsed, datetime):
+        parsed = datetime.combine(parsed, time())
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+async def move_recent_activity(batch_size: int = 500) -> int:
+    """Moves the legacy recent_activity arrays out of user_activity into activity_log.
+
+    Entries older than the user's retention are dropped instead of copied, the TTL index
+    would only delete them again.
+
+    Args:
+        batch_size: How many users to move per bulk write.
+
+    Returns:
+        int: The number of users migrated.
+    """
+    query = {"recent_activity": {"$exists": True}}
+
+    migrated = 0
+    while True:
+        activities = await db.user_activity.find(query, {"user_id": 1, "recent_activity": 1}).limit(batch_size).to_list(length=batch_size)
+        if not activities:
+            return migrated
+
+        users = await db.usersV2.find(
+            {"user_id": {"$in": [activity["user_id"] for activity in activities]}},
+            {"_id": 0, "user_id": 1, "subscription_type": 1}
+        ).to_list(length=None)
+        tiers = {user["user_id"]: user.get("subscription_type", "free") for user in users}
+
+        inserts = []
+        for activity in activities:
+            retention = timedelta(days=ACTIVITY_RETENTION.get(tiers.get(activity["user_id"]), ACTIVITY_RETENTION["free"]))
+            for action_type, entries in (activity.get("recent_activity") or {}).items():
+                for entry in entries or []:
+                    timestamp = _parse_timestamp(entry.get("timestamp"))
+                    expires_at = timestamp + retention
+                    if expires_at <= datetime.now(timezone.utc):
+                        continue
+                    inserts.append(InsertOne({
+                        **entry,
+                        "user_id": activity["user_id"],
+                        "action_type": action_type,
+                        "timestamp": timestamp,
+                        "expires_at": expires_at
+                    }))
+
+        if inserts:
+            await db.activity_log.bulk_write(inserts, ordered=False)
+
+        await db.user_activity.update_many(
+            {"_id": {"$in": [activity["_id"] for activity in activities]}},
+            {"$unset": {"recent_activity": ""}}
+        )
+
+        migrated += len(activities)
+        print(f"Moved recent activity for {migrated} users")
+
+async def split_provider_usage() -> int:
+    """Copies the per-day counters from the single providers document into provider_usage.
+
+    Uses $max, so running it again (or after new usage was counted) never double counts.
+
+    Returns:
+        int: The number of provider days written.
+    """
+    data = await db.providers.find_one({}) or {}
+    operations = [
+        UpdateOne({"provider": provider, "date": day}, {"$max": {"usage": usage}}, upsert=True)
+        for provider, days in data.items() if isinstance(days, dict)
+        for day, usage in days.items() if isinstance(usage, (int, float))
+    ]
+    if operations:
+        await db.provider_usage.bulk_write(operations, ordered=False)
+    print(f"Moved {len(operations)} provider usage days")
+    return len(operations)
+
+async def split_model_usage() -> int:
+    """Copies the usage map of the single models document into model_usage and model_users.
+
+    The old totals have no per-day breakdown, so they are stored with `date: None`.
+    Uses $max, so running it again never double counts.
+
+    Returns:
+        int: The number of models written.
+    """
+    data = await db.models.find_one({}, {"usage": 1}) or {}
+    usage_ops, user_ops = [], []
+
+    for model, info in (data.get("usage") or {}).items():
+        if not isinstance(info, dict):
+            continue
+        tokens = info.get("tokens") or {}
+        usage_ops.append(UpdateOne(
+            {"model": model, "date": None},
+            {"$max": {"usage": info.get("usage", 0), "tokens.input": tokens.get("input", 0), "tokens.output": tokens.get("output", 0)}},
+            upsert=True
+        ))
+        user_ops.extend(
+            UpdateOne({"model": model, "user_id": user_id}, {"$max": {"usage": count}}, upsert=True)
+            for user_id, count in (info.get("users") or {}).items()
+        )
+
+    if usage_ops:
+        await db.model_usage.bulk_write(usage_ops, ordered=False)
+    if user_ops:
+        await db.model_users.bulk_write(user_ops, ordered=False)
+    print(f"Moved usage for {len(usage_ops)} models")
+    return len(usage_ops)
+
+async def main(batch_size: int) -> None:
+    # one event loop for every step, the motor client is bound to the loop it first runs on
+    await split_user_documents(batch_size)
+    await move_recent_activity(batch_size)
+    await split_provider_usage()
+    await split_model_usage()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move usage, activity and counters out of the single large documents.")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.batch_size))
@@ -5,6 +5,7 @@ import traceback
 from typing import Dict, List
 
 from .db_config import db
+from .accounting import accounting
 
 class ModelManager:
     @staticmethod
@@ -46,14 +47,13 @@ class ModelManager:
         
     @staticmethod
     async def get_model_usages() -> Dict[str, int]:
-        """Get the usage of all models
+        """Get the usage of all models, summed over the per-day documents by the model_usage_totals view
 
         Returns:
             Dict[str, int]: Returns a dictionary of all model names and their usage
         """
         try:
-            data = await ModelManager.__load_db__()
-            return {model: info['usage'] for model, info in data.get('usage', {}).items()}
+            return {totals['_id']: totals['usage'] async for totals in db.model_usage_totals.find({})}
         except Exception as e:
             traceback.print_exc()
             print(e)
@@ -61,32 +61,13 @@ class ModelManager:
     
     @staticmethod
     async def update_model_usage(model: str, user: str) -> bool:
-        """Update the usage of a model"""
-        try:
-            data = await ModelManager.__load_db__()
-            if 'usage' not in data:
-                data['usage'] = {}
-            if model not in data['usage']:
-                data['usage'][model] = {'usage': 1, 'users': {user: 1}}
-            else:
-                if 'usage' not in data['usage'][model]:
-                    data['usage'][model]['usage'] = 0
-                data['usage'][model]['usage'] += 1
-                if 'users' not in data['usage'][model]:
-                    data['usage'][model]['users'] = {}
-                if user not in data['usage'][model]['users']:
-                    data['usage'][model]['users'][user] = 1
-                else:
-                    data['usage'][model]['users'][user] += 1
-            return await ModelManager.__save_db__(data)
-        except Exception as e:
-            traceback.print_exc()
-            print(e)
-            return False
+        """Update the usage of a model, buffered and written by the accounting flush"""
+        accounting.add_model_usage(model, user_id=user, usage=1)
+        return True
     
     @staticmethod
     async def update_model_tokens(model: str, input_tokens: int = None, output_tokens: int = None) -> bool:
-        """update the total input and output tokens for a model
+        """update the total input and output tokens for a model, buffered and written by the accounting flush
         
 
         Args:
@@ -97,23 +78,5 @@ class ModelManager:
         Returns:
             bool: whether or not the update was successful
         """
-        try:
-            data = await ModelManager.__load_db__()
-            if 'usage' not in data:
-                data['usage'] = {}
-            if model not in data['usage']:
-                data['usage'][model] = {}
-            
-            if 'tokens' not in data['usage'][model]:
-                data['usage'][model]['tokens'] = {'input': 0, 'output': 0}
-            
-            if input_tokens is not None:
-                data['usage'][model]['tokens']['input'] += input_tokens
-            if output_tokens is not None:
-                data['usage'][model]['tokens']['output'] += output_tokens
-            
-            return await ModelManager.__save_db__(data)
-        except Exception as e:
-            traceback.print_exc()
-            print(e)
-            return False
+        accounting.add_model_usage(model, input_tokens=input_tokens, output_tokens=output_tokens)
+        return True
\ No newline at end of file
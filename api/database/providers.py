@@ -1,75 +1,60 @@
-from bson.json_util import dumps, loads
-import ujson
 from datetime import date
 from typing import Optional
+import time
 
+from api.config import config
 from .db_config import db
+from .accounting import accounting
+
+# {provider: (expires, date, usage)}
+USAGE_CACHE: dict[str, tuple[float, str, int]] = {}
+USAGE_CACHE_TTL: int = getattr(config, 'provider_usage_cache_ttl', 5)
 
 class ProviderManager:
-    @staticmethod
-    async def __load_db__():
-        try:
-            data = await db.providers.find_one({})
-            return ujson.loads(dumps(data)) if data else {}
-        except:
-            return {}
+    """Daily request counters per provider, one `provider_usage` document per provider and day."""
 
     @staticmethod
-    async def __save_db__(data: dict):
-        try:
-            if data:
-                await db.providers.update_one({}, {"$set": loads(dumps(data))}, upsert=True)
-        except Exception as e:
-            print(f"Error saving provider database: {e}")
+    def __cache_usage__(provider: str, current_date: str, usage: int) -> None:
+        USAGE_CACHE[provider] = (time.monotonic() + USAGE_CACHE_TTL, current_date, usage)
 
     @staticmethod
     async def update_provider_usage(provider: str) -> bool:
         """
         Updates the usage count for a provider for the current date.
-        Increments the usage by 1.
-        
+        Increments the usage by 1, buffered and written by the accounting flush.
+        Daily limits are enforced by the quota leases in api/utils/provider_manager/quota.py.
+
         Args:
             provider: The name of the provider to update
-            
+
         Returns:
             bool: True if update was successful, False otherwise
         """
-        try:
-            current_date = date.today().isoformat()
-            data = await ProviderManager.__load_db__()
-            
-            if provider not in data:
-                data[provider] = {}
-            
-            if current_date not in data[provider]:
-                data[provider][current_date] = 0
-                
-            data[provider][current_date] += 1
-            
-            await ProviderManager.__save_db__(data)
-            return True
-        except Exception as e:
-            print(f"Error updating provider usage: {e}")
-            return False
+        accounting.add_provider_usage(provider)
+        return True
 
     @staticmethod
     async def get_provider_usage_today(provider: str) -> Optional[int]:
         """
         Gets the usage count for a provider for the current date.
-        
+        Served from a short lived local cache when possible.
+
         Args:
             provider: The name of the provider to check
-            
+
         Returns:
             Optional[int]: The usage count for today, or None if not found
         """
         try:
             current_date = date.today().isoformat()
-            data = await ProviderManager.__load_db__()
-            
-            if provider in data and current_date in data[provider]:
-                return data[provider][current_date]
-            return 0
+            cached = USAGE_CACHE.get(provider)
+            if cached and time.monotonic() < cached[0] and cached[1] == current_date:
+                return cached[2]
+
+            data = await db.provider_usage.find_one({"provider": provider, "date": current_date}, {"_id": 0, "usage": 1})
+            usage = data["usage"] if data else 0
+            ProviderManager.__cache_usage__(provider, current_date, usage)
+            return usage
         except Exception as e:
             print(f"Error getting provider usage: {e}")
-            return None
\ No newline at end of file
+            return None
@@ -1,33 +1,145 @@
 import string
 import random
-from datetime import date
+from datetime import date, datetime, timedelta, timezone
 import ujson
 
+from pymongo.errors import DuplicateKeyError
+
+from api.utils.redis_manager import RequestPipeline, redis
 from api.config import subscription_types, config
 from .db_config import db
+from .cache import user_cache
+from .accounting import accounting
+from .daily_usage import get_daily_credits, consume_daily_credits
 
 with open("data/models/list.json", 'r') as f:
     model_list = ujson.load(f)
 
+MODEL_COSTS: dict[str, int] = {obj['id']: int(obj['cost']) for obj in model_list['data']}
+
+# fields needed to authenticate a request, these are what the user cache holds
+AUTH_PROJECTION = {
+    "_id": 0,
+    "user_id": 1,
+    "banned": 1,
+    "subscription_type": 1,
+    "rate_limit": 1,
+    "credit_limit": 1,
+    "keys": 1,
+    "key": 1,
+}
+
+# usersV2 only holds the hot auth fields above plus billing info, the ever growing data
+# lives in user_usage (counters, token totals, ips) and user_activity, both keyed by user_id
+USAGE_FIELDS = ("usage", "daily_usage", "models", "ip")
+ACTIVITY_FIELDS = ("recent_activity", "model_usage_count", "last_activity_date", "last_model_used")
+
+# how long activity_log entries are kept, in days per subscription tier
+ACTIVITY_RETENTION: dict[str, int] = {
+    "free": 7,
+    "basic": 30,
+    "premium": 90,
+    "custom": 90,
+    **getattr(config, 'activity_retention', {}),
+}
+MAX_ACTIVITY_PAGE = 500
+IP_SEEN_TTL: int = getattr(config, 'ip_seen_ttl', 24 * 60 * 60)
+
+def get_model_cost(model: str | None) -> int:
+    """Returns the credit cost of a model, defaults to 1."""
+    if not model:
+        return 1
+
+    model = model.lower().replace("-online", '').replace("-json", '')
+    return MODEL_COSTS.get(model, 1)
+
+def user_filter(key_or_id: str) -> dict:
+    """Matches a user by user_id, new style key or legacy key in a single query."""
+    return {"$or": [{"user_id": key_or_id}, {"keys.key": key_or_id}, {"key": key_or_id}]}
+
 class DatabaseManager:
     """Manages database operations for user accounts and usage."""
 
+    @staticmethod
+    async def _update_user(key_or_id: str, update: dict) -> str | None:
+        """Applies an update to a user found by key or ID and invalidates the cached auth fields.
+
+        Returns:
+            The updated user's ID, or None if no user matched.
+        """
+        if not key_or_id:
+            return None
+
+        user = await db.usersV2.find_one_and_update(user_filter(key_or_id), update, projection={"_id": 0, "user_id": 1, "key": 1})
+        if user:
+            await user_cache.invalidate(user_identity(user))
+            return user_identity(user)
+        return None
+
+    @staticmethod
+    async def _find_usage(key_or_id: str, projection: dict) -> dict | None:
+        """Finds a user's usage document, resolving the key through the user cache.
+
+        Args:
+            key_or_id: The API key (new or legacy format) or user_id.
+            projection: The usage fields the caller needs.
+        """
+        user_id = await DatabaseManager._get_user_id(key_or_id)
+        if user_id is None:
+            return None
+        return await db.user_usage.find_one({"user_id": user_id}, {"_id": 0, "user_id": 1, **projection}) or {"user_id": user_id}
+
     @staticmethod
     async def _get_user_id(key_or_id: str) -> str | None:
         """Retrieves a user's ID (string) based on key or ID. No ObjectId conversion."""
-        user = await db.usersV2.find_one({"user_id": key_or_id})
-        if user:
-            return user["user_id"]
+        user = await DatabaseManager.get_auth_user(key_or_id)
+        return user["user_id"] if user else None
 
-        user = await db.usersV2.find_one({"keys.key": key_or_id})
-        if user:
-            return user["user_id"]
+    @staticmethod
+    async def get_auth_user(key_or_id: str) -> dict | None:
+        """Resolves a key or user_id to its auth fields, served from the user cache when possible.
 
-        user = await db.usersV2.find_one({"key": key_or_id})
-        if user:
-            return user.get("user_id", None)
+        Args:
+            key_or_id: The API key (new or legacy format) or user_id.
 
-        return None
+        Returns:
+            The user document projected to AUTH_PROJECTION, or None if nothing matches.
+        """
+        if not key_or_id:
+            return None
+
+        user = user_cache.get(key_or_id)
+        if user is None:
+            user = await db.usersV2.find_one(user_filter(key_or_id), AUTH_PROJECTION)
+            if user:
+                user_cache.set(user)
+        return user
+
+    @staticmethod
+    async def charge_request(user_id: str, credit_limit: int, model: str | None = None, pipeline: RequestPipeline | None = None) -> tuple[bool, int, int]:
+        """Spends the model's cost from a resolved user's daily credits, if it fits.
+
+        Checks the daily limit, spends the credits and counts the usage in one step for
+        the request path, without looking the user up again.
+
+        Args:
+            user_id: The user to charge.
+            credit_limit: The user's daily credit limit.
+            model: The requested model, its cost defaults to 1.
+            pipeline: Send the Redis script as part of this request pipeline.
+
+        Returns:
+            tuple[bool, int, int]: (allowed, remaining credits, seconds until the reset).
+        """
+        allowed, remaining, reset = await consume_daily_credits(user_id, get_model_cost(model), credit_limit, pipeline)
+        if not allowed:
+            return allowed, remaining, reset
+
+        increments = {"usage": 1}
+        if model:
+            increments[f"models.{model}.usage"] = 1
+        accounting.add_usage(user_id, increments)
+        return allowed, remaining, reset
 
     @staticmethod
     async def create_account(user_id: str = None) -> tuple[str]:
@@ -42,16 +154,20 @@ class DatabaseManager:
             "key": key,
             "user_id": user_id,
             "banned": False,
-            "ip": [],
-            "usage": 0,
             "subscription_type": "free",
             'credit_limit': config.free.credits,
             'rate_limit': config.free.rate_limit,
+            "keys": [{"key": key, "name": "default", "created": date.today().isoformat()}]
+        }
+        usage_data = {
+            "user_id": user_id,
+            "ip": [],
+            "usage": 0,
             "daily_usage": {date.today().isoformat(): 0},
             "models": {},
-            "keys": [{"key": key, "name": "default", "created": date.today().isoformat()}]
         }
         result = await db.usersV2.insert_one(user_data)
+        await db.user_usage.insert_one(usage_data)
         return key
 
 
@@ -59,49 +175,42 @@ class DatabaseManager:
     async def delete_account(user_id: str) -> None:
         """Deletes a user account."""
         await db.usersV2.delete_one({"user_id": user_id})
+        await db.user_usage.delete_one({"user_id": user_id})
+        await db.user_activity.delete_one({"user_id": user_id})
+        await user_cache.invalidate(user_id)
 
     @staticmethod
-    
     async def key_check(value: str) -> tuple[bool, str | None]:
         """Checks if an API key exists."""
-        user = await db.usersV2.find_one({"keys.key": value})
+        user = await DatabaseManager.get_auth_user(value)
         if user:
             key_data = next((k for k in user.get("keys", []) if k["key"] == value), None)
-            return True, key_data["key"]
-        user = await db.usersV2.find_one({"key": value})
-        return bool(user), user.get('key') if user else None
+            if key_data:
+                return True, key_data["key"]
+            if user.get("key") == value:
+                return True, user["key"]
+        return False, None
 
     @staticmethod
     async def id_check(user_id: str) -> list[dict]:
         """Checks if a user ID exists and retrieves associated API keys."""
-        user = await db.usersV2.find_one({"user_id": user_id})
-        if user:
+        user = await DatabaseManager.get_auth_user(user_id)
+        if user and user["user_id"] == user_id:
             return user.get("keys", [])
         return []
 
     @staticmethod
     async def ban_check(value: str) -> bool:
         """Checks if a user is banned."""
-        user = await db.usersV2.find_one({"user_id": value})
+        user = await DatabaseManager.get_auth_user(value)
         if user:
             return user.get("banned", False)
-        user_id = await DatabaseManager._get_user_id(value)  # Lookup by key if not found by user_id
-        if user_id:
-            user = await db.usersV2.find_one({"user_id": user_id}) #  Changed to find by user_id.
-            if user: # check if user is found.
-              return user.get("banned", False)
         return False
 
     @staticmethod
     async def update_subscription_type(value: str, subscription_type: str) -> None:
         """Updates a user's subscription type."""
-        user = await db.usersV2.find_one({"user_id": value})  # Now looks up by user_id (string)
-        if not user:
-          user_id = await DatabaseManager._get_user_id(value)
-          if user_id:
-              user = await db.usersV2.find_one({"user_id": user_id})
-        if user: # Check if user found.
-          await db.usersV2.update_one({"user_id": user["user_id"]}, {"$set": {"subscription_type": subscription_type}})
+        await DatabaseManager._update_user(value, {"$set": {"subscription_type": subscription_type}})
 
     @staticmethod
     async def update_user_subscription(user_id: str, subscription_data: dict) -> None:
@@ -117,26 +226,19 @@ class DatabaseManager:
                                - subscription_status: The status of the subscription (e.g., "active", "canceled").
                                - current_period_end: (Optional) The end date of the current subscription period as a Unix timestamp.
         """
-        user = await db.usersV2.find_one({"user_id": user_id})
-        if not user:
-            user_id = await DatabaseManager._get_user_id(user_id)
-            if user_id:
-                user = await db.usersV2.find_one({"user_id": user_id})
+        update_fields = {}
+        if "stripe_customer_id" in subscription_data:
+            update_fields["stripe_customer_id"] = subscription_data["stripe_customer_id"]
+        if "subscription_id" in subscription_data:
+            update_fields["subscription_id"] = subscription_data["subscription_id"]
+        if "subscription_status" in subscription_data:
+            update_fields["subscription_status"] = subscription_data["subscription_status"]
+        if "current_period_end" in subscription_data:
+            update_fields["current_period_end"] = subscription_data["current_period_end"]
+
+        if update_fields:
+            await DatabaseManager._update_user(user_id, {"$set": update_fields})
 
-        if user:
-            update_fields = {}
-            if "stripe_customer_id" in subscription_data:
-                update_fields["stripe_customer_id"] = subscription_data["stripe_customer_id"]
-            if "subscription_id" in subscription_data:
-                update_fields["subscription_id"] = subscription_data["subscription_id"]
-            if "subscription_status" in subscription_data:
-                update_fields["subscription_status"] = subscription_data["subscription_status"]
-            if "current_period_end" in subscription_data:
-                update_fields["current_period_end"] = subscription_data["current_period_end"]
-
-            if update_fields:
-                await db.usersV2.update_one({"user_id": user["user_id"]}, {"$set": update_fields})
-                
     @staticmethod
     async def find_user_by_customer_id(customer_id: str) -> dict | None:
         """
@@ -146,20 +248,17 @@ class DatabaseManager:
             customer_id: The Stripe customer ID.
 
         Returns:
-            The user document (dict) if found, otherwise None.
+            The user's subscription fields (dict) if found, otherwise None.
         """
-        user = await db.usersV2.find_one({"stripe_customer_id": customer_id})
-        return user
-                    
+        return await db.usersV2.find_one(
+            {"stripe_customer_id": customer_id},
+            {"_id": 0, "user_id": 1, "subscription_type": 1, "stripe_customer_id": 1, "subscription_id": 1, "subscription_status": 1}
+        )
+
     @staticmethod
     async def get_subscription_type(value: str) -> str:
         """Retrieves a user's subscription type."""
-
-        user = await db.usersV2.find_one({"user_id": value})
-        if not user:
-          user_id = await DatabaseManager._get_user_id(value)
-          if user_id:
-              user = await db.usersV2.find_one({"user_id": user_id})
+        user = await DatabaseManager.get_auth_user(value)
         if user:
           return user.get("subscription_type", "free")
         return "free"
@@ -170,132 +269,93 @@ class DatabaseManager:
         return await DatabaseManager.get_subscription_type(value) != "free"
 
     @staticmethod
-    
     async def set_custom_subscription_values(value: str, rate_limit: int, credit_limit: int) -> None:
         """Sets custom subscription values for a user."""
-        user = await db.usersV2.find_one({"user_id": value})
-        if not user:
-          user_id = await DatabaseManager._get_user_id(value)
-          if user_id:
-              user = await db.usersV2.find_one({"user_id": user_id})
-
-        if user:
-          await db.usersV2.update_one({"user_id": user["user_id"]}, {"$set": {"rate_limit": int(rate_limit), "credit_limit": int(credit_limit), "subscription_type": "custom"}})
+        await DatabaseManager._update_user(
+            value,
+            {"$set": {"rate_limit": int(rate_limit), "credit_limit": int(credit_limit), "subscription_type": "custom"}}
+        )
 
     @staticmethod
-    
     async def get_custom_subscription_values(value: str) -> tuple[int, int]:
         """Retrieves custom subscription values for a user."""
-        user = await db.usersV2.find_one({"user_id": value})
-        if not user:
-          user_id = await DatabaseManager._get_user_id(value)
-          if user_id:
-              user = await db.usersV2.find_one({"user_id": user_id})
-
+        user = await DatabaseManager.get_auth_user(value)
         if user:
           return user.get('rate_limit', 0), user.get('credit_limit', 0)
 
         return 0, 0
 
     @staticmethod
-    
-    async def ip_check(value: str, id: str | None = None, key: str | None = None) -> bool:
-        """Checks and adds an IP address for a user, limiting to 3 IPs."""
-
-        user = None
-        if id:
-          user = await db.usersV2.find_one({"user_id": id})
+    async def _add_ip(user_id: str, ip: str) -> bool:
+        """Adds an IP to a user's usage document in one conditional update, limiting to 3 IPs.
 
-        if user is None: # If no user ID provided or not found, try key.
-            user_id = await DatabaseManager._get_user_id(key)
-            if user_id:
-                user = await db.usersV2.find_one({"user_id": user_id})
-
-        if user:
-            current_ips = user.get("ip", [])
-            if isinstance(current_ips, str):
-                current_ips = [current_ips]
-
-            if len(current_ips) < 3 and value not in current_ips:
-                await db.usersV2.update_one({"user_id": user["user_id"]}, {"$push": {"ip": value}})
+        Returns:
+            bool: Whether the IP is now one of the user's IPs.
+        """
+        # only matches if the ip is already there or there is room for it, so concurrent calls can't overshoot
+        query = {"user_id": user_id, "$or": [{"ip": ip}, {"ip.2": {"$exists": False}}]}
+        result = await db.user_usage.update_one(query, {"$addToSet": {"ip": ip}})
+        if result.matched_count:
+            return True
+
+        # the user is at the limit or has no usage document yet, only the latter is upserted;
+        # a full document is never touched, but two concurrent first inserts rely on the
+        # unique user_id index to stay a single document
+        try:
+            result = await db.user_usage.update_one({"user_id": user_id}, {"$setOnInsert": {"ip": [ip]}}, upsert=True)
+            if result.upserted_id is not None:
                 return True
-            return value in current_ips
-        
-        return False
-
+        except DuplicateKeyError:
+            pass
 
+        # another request created the document in between, it may still have room
+        result = await db.user_usage.update_one(query, {"$addToSet": {"ip": ip}})
+        return result.matched_count > 0
 
     @staticmethod
     async def add_ip(value: str, ip: str) -> bool:
-        """Adds an IP address to a user's record, limiting to 3 IPs."""
-        user = await db.usersV2.find_one({"user_id": value})
-        if not user:
-          user_id = await DatabaseManager._get_user_id(value)
-          if user_id:
-              user = await db.usersV2.find_one({"user_id": user_id})
+        """Adds an IP address to a user's record, limiting to 3 IPs.
 
-        if user:
-            existing_ips = user.get("ip", [])
-            if isinstance(existing_ips, str):
-                existing_ips = [existing_ips]
-            if ip not in existing_ips and len(existing_ips) < 3:
-                await db.usersV2.update_one({"user_id": user["user_id"]}, {"$push": {"ip": ip}})
-                return True
-            return ip in existing_ips
+        IPs already recorded are answered from a Redis set, so only new IPs reach Mongo.
+        """
+        user_id = await DatabaseManager._get_user_id(value)
+        if user_id is None:
+            return False
 
-        return False
+        seen_key = f"ips:{user_id}"
+        if await redis.sismember(seen_key, ip):
+            return True
 
+        added = await DatabaseManager._add_ip(user_id, ip)
+        if added:
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.sadd(seen_key, ip)
+                pipe.expire(seen_key, IP_SEEN_TTL)
+                await pipe.execute()
+        return added
 
     @staticmethod
     async def get_ips(value: str) -> list:
         """Gets the list of IPs associated with a user."""
-        user = await db.usersV2.find_one({"user_id": value})
-        if not user:
-          user_id = await DatabaseManager._get_user_id(value)
-          if user_id:
-              user = await db.usersV2.find_one({"user_id": user_id})
-
+        user = await DatabaseManager._find_usage(value, {"ip": 1})
         if user:
             return user.get("ip", [])
 
         return []
 
-
-
-    @staticmethod
-    async def usage_update(value: str, model: str | None = None) -> None:
-        """Updates the usage count for a user and optionally for a specific model."""
-        user = await db.usersV2.find_one({"user_id": value})
-        if not user:
-          user_id = await DatabaseManager._get_user_id(value)
-          if user_id:
-              user = await db.usersV2.find_one({"user_id": user_id})
-        if user:
-            await db.usersV2.update_one({"user_id": user["user_id"]}, {"$inc": {"usage": 1}})
-            if model:
-                await db.usersV2.update_one(
-                    {"user_id": user["user_id"], "models." + model: {"$exists": True}},
-                    {"$inc": {"models." + model + ".usage": 1}}
-                )
-                await db.usersV2.update_one(
-                    {"user_id": user["user_id"], "models." + model: {"$exists": False}},
-                    {"$set": {"models." + model: {"usage": 1, "tokens": {"input": 0, "output": 0}}}}
-                )
-
-
     @staticmethod
     async def reset_ip(value: str) -> None:
         """Resets the IP addresses associated with a user."""
+        user = await DatabaseManager.get_auth_user(value)
+        if user is None:
+            return
+        user_id = user_identity(user)
+        await db.user_usage.update_one({"user_id": user_id}, {"$set": {"ip": []}}, upsert=True)
+        await redis.delete(f"ips:{user_id}")
 
-        user = await db.usersV2.find_one({"user_id": value})
-
-        if not user:
-          user_id = await DatabaseManager._get_user_id(value)
-          if user_id:
-              user = await db.usersV2.find_one({"user_id": user_id})
-        if user:
-          await db.usersV2.update_one({"user_id": user["user_id"]}, {"$set": {"ip": []}})
-
+        # every worker's ip_tracker forgets the IPs it saw for these keys, so they are recorded again
+        for alias in user_cache.aliases(user):
+            await user_cache.invalidate(alias)
 
     @staticmethod
     async def add_key_to_user(user_id: str, name: str = "default", description: str = None) -> dict | None:
@@ -309,25 +369,15 @@ class DatabaseManager:
         Returns:
             The new API key data (including the key itself, name and the creation date) or None if the user doesn't exist.
         """
-        user = await db.usersV2.find_one({"user_id": user_id})
+        new_key_data = {
+            "key": f"shard-{''.join(random.choices(string.ascii_letters + string.digits, k=33))}",
+            "name": name,
+            "created": date.today().isoformat()
+        }
+        if description:
+          new_key_data["description"] = description
 
-        if not user:
-             user_id = await DatabaseManager._get_user_id(user_id)
-             if user_id:
-                user = await db.usersV2.find_one({"user_id": user_id})
-        
-        if user:
-            new_key_data = {
-                "key": f"shard-{''.join(random.choices(string.ascii_letters + string.digits, k=33))}",
-                "name": name,
-                "created": date.today().isoformat()
-            }
-            if description:
-              new_key_data["description"] = description
-            await db.usersV2.update_one(
-                {"user_id": user["user_id"]},
-                {"$push": {"keys": new_key_data}}
-            )
+        if await DatabaseManager._update_user(user_id, {"$push": {"keys": new_key_data}}):
             return new_key_data
         return None
 
@@ -340,186 +390,104 @@ class DatabaseManager:
             "created": date.today().isoformat()
         }
 
-        user = await db.usersV2.find_one({"user_id": user_id})
+        user = await db.usersV2.find_one_and_update(
+            {"user_id": user_id},
+            {"$set": {"keys": [key_data]}},
+            projection={"_id": 0, "user_id": 1}
+        )
         if user:
-            await db.usersV2.update_one(
-                {"user_id": user_id},
-                {"$set": {"keys": [key_data]}}
-            )
-            return await DatabaseManager.get_keys(user_id=user_id)
+            await user_cache.invalidate(user_id)
+            return [key_data]
 
         return []
 
     @staticmethod
-    
     async def get_usage(value: str) -> int:
         """Retrieves the total usage count for a user."""
-        user = await db.usersV2.find_one({"user_id": value})
-        if not user:
-          user_id = await DatabaseManager._get_user_id(value)
-          if user_id:
-              user = await db.usersV2.find_one({"user_id": user_id})
+        user = await DatabaseManager._find_usage(value, {"usage": 1})
         if user:
           return user.get("usage", 0)
         return 0
 
     @staticmethod
-    
     async def get_id(value: str) -> str | None:
         """Retrieves a user's ID (the string user_id, not ObjectId) from their API key or user_id.
            Handles both new "keys" list format and old single "key" format.
         """
-        user = await db.usersV2.find_one({"user_id": value})
-
-        if user:
-            return user["user_id"]
-
-        user = await db.usersV2.find_one({"keys.key": value})
-        if user:
-            return user["user_id"]
-
-        user = await db.usersV2.find_one({"key": value})  
-        if user:
-            return user.get("user_id", None) 
-
-        return None
-    
-    @staticmethod
-    async def reset_daily_usage_if_needed() -> None:
-        today = date.today().isoformat()
-        last_reset = await db.meta.find_one({"_id": "daily_usage_reset"})
-        if last_reset and last_reset.get("date") == today:
-            return
-        await db.usersV2.update_many(
-            {},
-            {"$set": {f"daily_usage.{today}": 0}},
-            upsert=False
-        )
-        await db.meta.update_one(
-            {"_id": "daily_usage_reset"},
-            {"$set": {"date": today}},
-            upsert=True
-        )
+        return await DatabaseManager._get_user_id(value)
 
     @staticmethod
     async def get_daily_usage(value: str) -> tuple[int, int, int, dict]:
-        """Retrieves the daily usage information for a user."""
+        """Retrieves the daily usage information for a user.
 
-        await DatabaseManager.reset_daily_usage_if_needed()
-        user = await db.usersV2.find_one({"user_id": value})
-        if not user:
-            user_id = await DatabaseManager._get_user_id(value)
-            if user_id:
-                user = await db.usersV2.find_one({"user_id": user_id})
+        Today's credits come from Redis, the history from the snapshots in user_usage.
+        """
+        user = await DatabaseManager.get_auth_user(value)
         if user:
+            counters = await db.user_usage.find_one({"user_id": user["user_id"]}, {"_id": 0, "usage": 1, "daily_usage": 1}) or {}
             today = date.today().isoformat()
-            daily_usage = user.get("daily_usage", {}).get(today, 0)
-            usage = user.get("usage", 0)
+            daily_usage = await get_daily_credits(user["user_id"])
+            counters.setdefault("daily_usage", {})[today] = daily_usage
+            usage = counters.get("usage", 0)
             subscription_type = user.get("subscription_type", "free")
             try:
                 limit = subscription_types[subscription_type]['credits'] if subscription_type != "custom" else user.get("credit_limit", 0)
             except KeyError:
                 print(f"Invalid subscription type: {subscription_type} for user: {value}")
                 limit = 0
-            return daily_usage, usage, limit, user.get("daily_usage", {})
+            return daily_usage, usage, limit, counters.get("daily_usage", {})
         return 0, 0, 0, {}
 
-    @staticmethod
-    async def update_daily_usage(value: str, model: str | None = None) -> bool:
-        """Updates the daily usage count for a user."""
-        user = await db.usersV2.find_one({"user_id": value})
-        if not user:
-            user_id = await DatabaseManager._get_user_id(value)
-            if user_id:
-                user = await db.usersV2.find_one({"user_id": user_id})
-        if user:
-            today = date.today().isoformat()
-            cost = 1
-
-            if model:
-                model = model.lower().replace("-online", '').replace("-json", '')
-                for obj in model_list['data']:
-                    if obj['id'] == model:
-                        cost = obj['cost']
-                        break
-            try:
-                await db.usersV2.update_one(
-                    {"user_id": user["user_id"]},
-                    {"$inc": {f"daily_usage.{today}": int(cost)}}
-                )
-                return True
-            except Exception as e:
-                print(f"Error updating daily usage: {e}")
-                return False
-        print('Did not find user for daily usage')
-        return False
-
     @staticmethod
     async def update_model_tokens(value: str, model: str, input_tokens: int | None = None, output_tokens: int | None = None) -> bool:
-        """Updates the token usage for a specific model by a user."""
-
-        user = await db.usersV2.find_one({"user_id": value})
-        if not user:
+        """Buffers the token usage for a specific model by a user."""
+        increments = {}
+        if input_tokens is not None:
+            increments["models." + model + ".tokens.input"] = input_tokens
+        if output_tokens is not None:
+            increments["models." + model + ".tokens.output"] = output_tokens
+
+        if increments:
             user_id = await DatabaseManager._get_user_id(value)
-            if user_id:
-                user = await db.usersV2.find_one({"user_id": user_id})
-        if user:
-            update_data = {}
-            if input_tokens is not None:
-                update_data["$inc"] = {"models." + model + ".tokens.input": input_tokens}
-            if output_tokens is not None:
-                if "$inc" not in update_data:
-                    update_data["$inc"] = {}
-                update_data["$inc"]["models." + model + ".tokens.output"] = output_tokens
-
-            if update_data:
-                try:
-                    await db.usersV2.update_one({"user_id": user["user_id"]}, update_data, upsert=True)
-                    return True
-                except Exception as e:
-                    print(f"Error updating model tokens: {e}")
-                    return False
+            if user_id is None:
+                return False
+            accounting.add_usage(user_id, increments)
+            return True
         return False
 
-
-
     @staticmethod
-    
     async def get_total_tokens(value: str) -> tuple[int, int]:
         """Retrieves the total input and output tokens used by a user across all models."""
-        user = await db.usersV2.find_one({"user_id": value})
-        if not user:
-            user_id = await DatabaseManager._get_user_id(value)
-            if user_id:
-                user = await db.usersV2.find_one({"user_id": user_id})
-        if user:
-          total_input = 0
-          total_output = 0
-          models = user.get("models", {})
-          if models and isinstance(models, dict):
-              for model_data in models.values():
-                  if isinstance(model_data, dict) and "tokens" in model_data:
-                      total_input += model_data["tokens"].get("input", 0)
-                      total_output += model_data["tokens"].get("output", 0)
-          return total_input, total_output
-        return 0,0
-
+        user_id = await DatabaseManager._get_user_id(value)
+        if user_id is None:
+            return 0, 0
+
+        # sum server side so the per-model map never leaves mongo
+        pipeline = [
+            {"$match": {"user_id": user_id}},
+            {"$limit": 1},
+            {"$project": {"models": {"$objectToArray": {"$ifNull": ["$models", {}]}}}},
+            {"$project": {
+                "_id": 0,
+                "input": {"$sum": "$models.v.tokens.input"},
+                "output": {"$sum": "$models.v.tokens.output"},
+            }},
+        ]
+        async for totals in db.user_usage.aggregate(pipeline):
+            return totals.get("input", 0), totals.get("output", 0)
+        return 0, 0
 
-        
     @staticmethod
     async def get_keys(user_id: str | None = None, value: str | None = None) -> list[dict]:
         """Retrieve all api keys associated with a user."""
-
-        user = await db.usersV2.find_one({"user_id": user_id}) # Find by user_id if given
+        user = await DatabaseManager.get_auth_user(user_id) if user_id else None
         if not user and value: # If not by id then by key or api key
-          user_id = await DatabaseManager._get_user_id(value) # find user_id
-          if user_id:
-            user = await db.usersV2.find_one({"user_id": user_id}) # and now find user by user_id
-        
+            user = await DatabaseManager.get_auth_user(value)
+
         if user:
           return user.get("keys", [])
         return []
-    
+
     @staticmethod
     async def delete_key_from_user(user_id: str, key: str) -> bool:
         """Deletes a specific API key from a user's account.
@@ -531,34 +499,24 @@ class DatabaseManager:
         Returns:
             True if the key was successfully deleted, False otherwise (e.g., user or key not found).
         """
-        user = await db.usersV2.find_one({"user_id": user_id})
-        if not user:
-             user_id = await DatabaseManager._get_user_id(user_id)
-             if user_id:
-                user = await db.usersV2.find_one({"user_id": user_id})
-        
+        if not user_id or not key:
+            return False
+
+        user = await db.usersV2.find_one_and_update(
+            {"$and": [user_filter(user_id), {"keys.key": key}]},
+            {"$pull": {"keys": {"key": key}}},
+            projection={"_id": 0, "user_id": 1}
+        )
         if user:
-            keys = user.get("keys", [])
-            updated_keys = [k for k in keys if k.get("key") != key]
-            if len(updated_keys) < len(keys):
-                await db.usersV2.update_one(
-                    {"user_id": user["user_id"]},
-                    {"$set": {"keys": updated_keys}}
-                )
-                return True
+            await user_cache.invalidate(user["user_id"])
+            return True
         return False
 
     @staticmethod
     async def ban_update(value: str, banned: bool) -> None:
         """Updates a user's ban status."""
-        user = await db.usersV2.find_one({"user_id": value})
-        if not user:
-            user_id = await DatabaseManager._get_user_id(value)
-            if user_id:
-                user = await db.usersV2.find_one({"user_id": user_id})
-        if user:
-            await db.usersV2.update_one({"user_id": user["user_id"]}, {"$set": {"banned": banned}})
-    
+        await DatabaseManager._update_user(value, {"$set": {"banned": banned}})
+
     @staticmethod
     async def update_recent_usage(value: str, model: str, input_tokens: int, output_tokens: int, action_type: str = "chat_completion", metadata: dict = None) -> None:
         """
@@ -572,68 +530,79 @@ class DatabaseManager:
             action_type (str): Type of API action (e.g., "chat_completion", "image_generation")
             metadata (dict): Optional additional request metadata
         """
-        user = await db.usersV2.find_one({"user_id": value})
-        if not user:
-            user_id = await DatabaseManager._get_user_id(value)
-            if user_id:
-                user = await db.usersV2.find_one({"user_id": user_id})
-        
-        if user:
-            credits_used = 1
-            model_normalized = model.lower().replace("-online", "").replace("-json", "")
-            for obj in model_list['data']:
-                if obj['id'] == model_normalized:
-                    credits_used = obj['cost']
-                    break
-
-            current_timestamp = date.today().isoformat()
-            activity_entry = {
-                "model": model,
-                "credits": credits_used,
-                "input_tokens": input_tokens,
-                "output_tokens": output_tokens,
-                "total_tokens": input_tokens + output_tokens,
-                "timestamp": current_timestamp,
-                "success": True
-            }
-
-            if metadata:
-                activity_entry["metadata"] = metadata
-
-            await db.usersV2.update_one(
-                {"user_id": user["user_id"]},
-                {
-                    "$push": {
-                        f"recent_activity.{action_type}": {
-                            "$each": [activity_entry],
-                        }
-                    },
-                    "$set": {
-                        "last_activity_date": current_timestamp,
-                        "last_model_used": model,
-                    },
-                    "$inc": {
-                        f"model_usage_count.{model}": 1,
-                    }
-                },
-                upsert=True
-            )
-
-
-    @staticmethod
-    async def get_recent_activity(value: str, resource_type: str | None) -> dict:
-        """Retrieve the recent requests, resource type or all."""
-        user = await db.usersV2.find_one({"user_id": value})
-        if not user:
-            user_id = await DatabaseManager._get_user_id(value)
-            if user_id:
-                user = await db.usersV2.find_one({"user_id": user_id})
-        
+        user = await DatabaseManager.get_auth_user(value)
+        if user is None:
+            return
+
+        now = datetime.now(timezone.utc)
+        retention = ACTIVITY_RETENTION.get(user.get("subscription_type", "free"), ACTIVITY_RETENTION["free"])
+        activity_entry = {
+            "user_id": user["user_id"],
+            "action_type": action_type,
+            "model": model,
+            "credits": get_model_cost(model),
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "timestamp": now,
+            "expires_at": now + timedelta(days=retention), # removed by the activity_log TTL index
+            "success": True
+        }
+
+        if metadata:
+            activity_entry["metadata"] = metadata
+
+        accounting.add_activity(
+            user["user_id"],
+            activity_entry,
+            {"last_activity_date": date.today().isoformat(), "last_model_used": model},
+            {f"model_usage_count.{model}": 1}
+        )
+
+    @staticmethod
+    async def get_recent_activity(
+        value: str,
+        resource_type: str | None,
+        limit: int = 50,
+        before: str | None = None,
+        after: str | None = None
+    ) -> dict | list:
+        """Retrieve the recent requests, resource type or all.
+
+        Args:
+            value (str): User ID or API key
+            resource_type (str | None): Only return this action type, as a list
+            limit (int): Maximum number of entries, newest first
+            before (str | None): ISO timestamp, only return older entries (use the last entry's timestamp to page)
+            after (str | None): ISO timestamp, only return newer entries
+
+        Returns:
+            dict | list: Entries grouped by action type, or a list if resource_type is given.
+        """
+        user_id = await DatabaseManager._get_user_id(value)
+        if user_id is None:
+            return [] if resource_type else {}
+
+        query = {"user_id": user_id}
+        if resource_type:
+            query["action_type"] = resource_type
+
+        timestamp_range = {}
+        if before:
+            timestamp_range["$lt"] = datetime.fromisoformat(before)
+        if after:
+            timestamp_range["$gt"] = datetime.fromisoformat(after)
+        if timestamp_range:
+            query["timestamp"] = timestamp_range
+
+        cursor = db.activity_log.find(query, {"_id": 0, "user_id": 0, "expires_at": 0})
+        cursor = cursor.sort("timestamp", -1).limit(max(1, min(int(limit), MAX_ACTIVITY_PAGE)))
+
         data = {}
-        
-        if user:
-            data = user.get("recent_activity", {})
-            if resource_type:
-                data = data.get(resource_type, [])
-        
-        return data
\ No newline at end of file
+        async for entry in cursor:
+            entry["timestamp"] = entry["timestamp"].isoformat()
+            data.setdefault(entry.pop("action_type"), []).append(entry)
+
+        if resource_type:
+            return data.get(resource_type, [])
+        return data
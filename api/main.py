@@ -9,7 +9,15 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI, HTTPException
 import starlette.requests
 
-from api.database import DatabaseManager
+from api.database import user_cache, accounting, ip_tracker
+from api.database.indexes import ensure_indexes, ensure_views
+from api.database.daily_usage import run_snapshots, consume_script
+from api.utils.provider_manager.plugins import plugins
+from api.utils.provider_manager.chat import health_checker
+from api.utils.provider_manager.quota import quota_leases
+from api.utils.provider_stats import provider_stats
+from api.utils.redis_manager import load_scripts, rate_limit_script
+from api.utils.http import http_clients
 from api import exceptions
 
 import uvloop # type: ignore
@@ -39,10 +47,47 @@ async def lifespan(app: FastAPI):
             print("💎 API is up!")
     except FileExistsError:
         pass
+
+    # create missing indexes and views, problems are printed and don't block startup
+    await ensure_indexes()
+    await ensure_views()
+
+    # so request pipelines can send the credit and rate limit scripts as a bare EVALSHA
+    await load_scripts(consume_script, rate_limit_script)
+
+    # write usage a previous run buffered but never flushed
+    await accounting.replay()
+
+    # start provider selection from the latency other workers measured
+    await provider_stats.load()
+
+    # import the providers of the models in `provider_warmup`, the rest load on first use
+    plugins.warm_up()
+
+    # background tasks, cancelled on shutdown
+    tasks = [
+        asyncio.create_task(user_cache.listen()),
+        asyncio.create_task(accounting.run()),
+        asyncio.create_task(run_snapshots()),
+        asyncio.create_task(quota_leases.run()),
+        asyncio.create_task(provider_stats.run()),
+        asyncio.create_task(plugins.watch()),
+        asyncio.create_task(plugins.listen()),
+        asyncio.create_task(http_clients.prewarm()),
+        asyncio.create_task(health_checker.run()),
+    ]
     
     yield # seperate startup from shutdown
     
     # on shutdown
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await ip_tracker.drain()
+    await quota_leases.release_all()
+    await accounting.flush()
+    await http_clients.close()
+
     try:
         # remove tmp flags used for logging
         [os.remove(f"/tmp/{flag}") for flag in flags if os.path.exists(f"/tmp/{flag}")]
@@ -78,11 +123,24 @@ class IPHandler:
             
             auth = auth.replace("Bearer ", "")
             
-            await DatabaseManager.add_ip(auth, ip)
+            # recorded in the background, the response doesn't wait on it
+            ip_tracker.track(auth, ip)
         return response 
 
 app.middleware("http")(IPHandler())
 
+class RateLimitHeaders:
+    async def __call__(self, request: starlette.requests.Request, call_next):
+        response = await call_next(request)
+
+        # set by the rate_limit check, also present on 429s
+        headers = getattr(request.state, "rate_limit_headers", None)
+        if headers:
+            response.headers.update(headers)
+        return response
+
+app.middleware("http")(RateLimitHeaders())
+
 def load_routers(app, package_name: str, dir: Path) -> None:
     for root, _, files in os.walk(dir):
         for file in files:
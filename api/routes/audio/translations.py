@@ -11,7 +11,7 @@ import ujson
 
 from api.utils.checks import user_checks, rate_limit
 from api.utils.logging import print_status
-from api.database import DatabaseManager
+from api.utils.auth import get_auth_context
 
 sys.path.append('....')
 from ai.whisper.main import WhisperTranscriber
@@ -37,8 +37,7 @@ async def translations_route(
 ):
     start_time: float = time.time()
     
-    auth = request.headers.get("Authorization", None).replace("Bearer ", '')
-    user = await DatabaseManager.get_id(auth)
+    user = (await get_auth_context(request)).user_id
     
     if model not in models:
         raise HTTPException(status_code=400, detail=f"Invalid model. Valid models are: {models}")
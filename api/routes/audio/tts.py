@@ -8,7 +8,7 @@ from api.providers.tts import elevenlabs, speechify, suno, tts as google_tts
 
 from api.utils.checks import user_checks, rate_limit
 from api.utils.logging import print_status
-from api.database import DatabaseManager
+from api.utils.auth import get_auth_context
 from api.providers.tts import openai
 from api.providers.tts import edge
 from api.schemas import TtsBody
@@ -20,9 +20,9 @@ with open('data/models/fakeyou.json', 'r') as f:
 
 @app.post("/v1/audio/speech", dependencies=[Depends(user_checks), Depends(rate_limit)])
 async def tts(request: Request, data: TtsBody):
-    key = request.headers.get("Authorization", "").replace("Bearer ", "")
+    auth = await get_auth_context(request)
 
-    premium = await DatabaseManager.get_subscription_type(key) in ['basic', 'premium']
+    premium = auth.subscription_type in ['basic', 'premium']
     start = time.time()
 
     if data.model == "gtts":
@@ -51,6 +51,6 @@ async def tts(request: Request, data: TtsBody):
             }
         }, status_code=500)
     else:
-        await print_status(True, round((time.time() - start), 2), data.model, await DatabaseManager.get_id(value=request.headers.get("Authorization").replace("Bearer ", "")), response=data.input)
+        await print_status(True, round((time.time() - start), 2), data.model, auth.user_id, response=data.input)
 
     return Response(content=content, media_type="audio/mpeg", headers={"Content-Disposition": "attachment;filename=audio.mp3"})
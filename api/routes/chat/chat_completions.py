@@ -12,6 +12,7 @@ from api.utils.tokenizer import get_input_count, get_output_count
 from api.utils.moderation import openai_moderation, moderation
 from api.database import DatabaseManager, ModelManager
 from api.utils.checks import user_checks, rate_limit
+from api.utils.auth import get_auth_context
 from api.utils.provider_manager import handle_chat
 from api.utils.helpers import clean_messages
 from api.utils.tools import ToolCalls
@@ -49,9 +50,10 @@ class ChatHandler:
     async def _load_user_data(self) -> None:
         """Loads user data from the database."""
         try:
-            self.user = await DatabaseManager.get_id(self.key)
-            self.subscription_type = await DatabaseManager.get_subscription_type(self.key)
-            self.premium = self.subscription_type in ['basic', 'premium', 'custom']
+            auth = await get_auth_context(self.request)
+            self.user = auth.user_id
+            self.subscription_type = auth.subscription_type
+            self.premium = auth.premium
         except Exception as e:
             trace_id = await log_and_return_error_id(
                 e,
@@ -146,7 +148,8 @@ class ChatHandler:
                         handle_chat, 
                         data=ChatBody(**request_data), 
                         key=self.key, 
-                        stream=False
+                        stream=False,
+                        subscription_type=self.subscription_type
                     )
                     if c is not None:
                         return c
@@ -169,7 +172,7 @@ class ChatHandler:
             if stream:
                 input_tokens = await get_input_count(self.data.messages)
                 await ModelManager.update_model_tokens(self.data.model.lower(), input_tokens=input_tokens)
-                await DatabaseManager.update_model_tokens(self.key, self.data.model.lower(), input_tokens=input_tokens)
+                await DatabaseManager.update_model_tokens(self.user, self.data.model.lower(), input_tokens=input_tokens)
                 
                 request_data = self._prepare_request_data(include_tools=False)
                 try:
@@ -262,10 +265,10 @@ class ChatHandler:
         output_tokens = await get_output_count(content)
         model = self.data.model.lower()
         await ModelManager.update_model_tokens(model, input_tokens, output_tokens)
-        await DatabaseManager.update_model_tokens(self.key, model, input_tokens, output_tokens)
+        await DatabaseManager.update_model_tokens(self.user, model, input_tokens, output_tokens)
 
         # update recent activity as well
-        await DatabaseManager.update_recent_usage(self.key, model, input_tokens, output_tokens, "chat")
+        await DatabaseManager.update_recent_usage(self.user, model, input_tokens, output_tokens, "chat")
 
     async def handle_request(self) -> Any:
         """Main method to handle incoming chat request."""
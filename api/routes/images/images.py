@@ -7,7 +7,7 @@ import ujson
 from api.utils.checks import user_checks, rate_limit
 from api.utils.provider_manager import handle_images
 from api.utils.logging import print_status
-from api.database import DatabaseManager
+from api.utils.auth import get_auth_context
 from api.schemas import ImagesBody
 
 app = APIRouter()
@@ -15,8 +15,7 @@ app = APIRouter()
 @app.post("/v1/images/generations", dependencies=[Depends(user_checks), Depends(rate_limit)])
 async def images(request: Request, data: ImagesBody):
     start = time.time()
-    key = request.headers.get("Authorization", "").replace("Bearer ", "")
-    user = await DatabaseManager.get_id(key)
+    user = (await get_auth_context(request)).user_id
     try:
         url = await handle_images(data.model_dump())
         if url:
@@ -11,6 +11,7 @@ from api.utils.redis_manager import get_or_set_cache, generate_cache_key
 from api.utils.tokenizer import get_input_count, get_output_count
 from api.database import DatabaseManager, ModelManager
 from api.utils.checks import user_checks, rate_limit
+from api.utils.auth import get_auth_context
 from api.schemas import AnthropicChatBody, ChatBody
 from api.utils.provider_manager import handle_chat
 from api.utils.helpers import clean_messages
@@ -39,9 +40,10 @@ class ChatHandler:
 
     async def _load_user_data(self) -> None:
         try:
-            self.user = await DatabaseManager.get_id(self.key)
-            self.subscription_type = await DatabaseManager.get_subscription_type(self.key)
-            self.premium = self.subscription_type in ['basic', 'premium', 'custom']
+            auth = await get_auth_context(self.request)
+            self.user = auth.user_id
+            self.subscription_type = auth.subscription_type
+            self.premium = auth.premium
         except Exception as e:
             trace_id = await log_and_return_error_id(
                 e,
@@ -107,7 +109,8 @@ class ChatHandler:
                         handle_chat, 
                         data=ChatBody(**request_data), 
                         key=self.key, 
-                        stream=False
+                        stream=False,
+                        subscription_type=self.subscription_type
                     )
                     if c is not None:
                         return c
@@ -130,7 +133,7 @@ class ChatHandler:
             if stream:
                 input_tokens = await get_input_count(self.data.messages)
                 await ModelManager.update_model_tokens(self.data.model.lower(), input_tokens=input_tokens)
-                await DatabaseManager.update_model_tokens(self.key, self.data.model.lower(), input_tokens=input_tokens)
+                await DatabaseManager.update_model_tokens(self.user, self.data.model.lower(), input_tokens=input_tokens)
                 
                 request_data = self._prepare_request_data()
                 return await handle_chat(ChatBody(**request_data), self.key, True)
@@ -155,7 +158,7 @@ class ChatHandler:
         output_tokens = await get_output_count(content)
         model = self.data.model.lower()
         await ModelManager.update_model_tokens(model, input_tokens, output_tokens)
-        await DatabaseManager.update_model_tokens(self.key, model, input_tokens, output_tokens)
+        await DatabaseManager.update_model_tokens(self.user, model, input_tokens, output_tokens)
 
     async def handle_request(self) -> Any:
         await user_checks(self.request)
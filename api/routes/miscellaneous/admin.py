@@ -5,6 +5,13 @@ from time import strftime
 import ujson
 import yaml
 
+from api.utils.provider_manager.concurrency import provider_limits
+from api.utils.provider_manager.hedging import hedge_policy
+from api.utils.provider_manager.plugins import plugins
+from api.utils.provider_manager.chat import health_checker, STREAM_FAILOVERS
+from api.utils.circuit_breaker import circuit_breakers
+from api.utils.provider_stats import provider_stats
+from api.utils.http import http_clients
 from api.config import config
 from api.database import DatabaseManager
 
@@ -34,7 +41,9 @@ def handle_action(action: str, data: dict):
         'ips': get_ips,
         "subscription": get_subscription,
         "add": add_key, # add a key to user
-        "get_activity": get_activity # get users recent activity
+        "get_activity": get_activity, # get users recent activity
+        "providers": get_provider_stats, # provider latency, breakers, queues and hedging
+        "reload_providers": reload_providers # re-import changed provider modules on every worker
     }
 
     if action not in actions:
@@ -60,6 +69,8 @@ async def admin(request: Request, action: str, data: dict = Body(...)) -> Respon
             validate_payload(['id', 'key', 'banned', 'premium', 'resetip'], data, action)
         elif action == "delete":
             validate_payload(['id', 'key'], data, action)
+        elif action in {"providers", "reload_providers"}:
+            pass
         else:
             validate_payload(['id'], data, action)
         
@@ -185,5 +196,26 @@ async def add_key(data: dict) -> Response:
     return Response(ujson.dumps({'success': True, 'key': success}, indent=4), media_type='application/json')
 
 async def get_activity(data: dict) -> Response:
-    data = await DatabaseManager.get_recent_activity(data.get("id"), data.get("resource", None))
-    return Response(ujson.dumps({"success": True, "data": data}, indent=4), media_type="application/json")
\ No newline at end of file
+    data = await DatabaseManager.get_recent_activity(
+        data.get("id"),
+        data.get("resource", None),
+        limit=data.get("limit", 50),
+        before=data.get("before", None),
+        after=data.get("after", None)
+    )
+    return Response(ujson.dumps({"success": True, "data": data}, indent=4), media_type="application/json")
+
+async def get_provider_stats(data: dict) -> Response:
+    return Response(ujson.dumps({
+        "success": True,
+        "providers": provider_stats.snapshot(),
+        "breakers": circuit_breakers.stats(),
+        "concurrency": provider_limits.stats(),
+        "hedging": hedge_policy.stats(),
+        "http": http_clients.stats(),
+        "health": health_checker.stats(),
+        "stream_failovers": STREAM_FAILOVERS
+    }, indent=4), media_type="application/json")
+
+async def reload_providers(data: dict) -> Response:
+    return Response(ujson.dumps({"success": True, **await plugins.reload_all()}, indent=4), media_type="application/json")
\ No newline at end of file
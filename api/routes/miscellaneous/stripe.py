@@ -98,7 +98,7 @@ class StripeWebhookHandler:
         user = await DatabaseManager.find_user_by_customer_id(customer_id)
 
         if user:
-            user_id = user["_id"]
+            user_id = user["user_id"]
             plan = None
             if subscription_plan == stripe_plans.basic.prod_price_id or subscription_plan == stripe_plans.basic.test_price_id:
                 plan = "Basic"
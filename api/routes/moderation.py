@@ -8,7 +8,7 @@ import ujson
 from api.utils.checks import rate_limit, user_checks
 from api.utils.provider_manager import handle_moderation
 from api.utils.logging import print_status
-from api.database import DatabaseManager
+from api.utils.auth import get_auth_context
 from api.schemas import ModerationBody
 
 app = APIRouter()
@@ -16,8 +16,7 @@ app = APIRouter()
 @app.post("/v1/moderations", dependencies=[Depends(user_checks), Depends(rate_limit)])
 async def embeddings(request: Request, data: ModerationBody):
     start = time.time()
-    key = request.headers.get("Authorization", "").replace("Bearer ", "")
-    user = await DatabaseManager.get_id(key)
+    user = (await get_auth_context(request)).user_id
     
     try:
         for _ in range(4):
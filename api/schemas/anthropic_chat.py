@@ -6,6 +6,7 @@ from fastapi import HTTPException
 import ujson
 
 from api.utils.tokenizer import input_count_schema
+from api.utils.bad_models import bad_models
 
 def load_model_ids(file_path: str, model_type: str) -> List[str]:
     with open(file_path, "r") as f:
@@ -17,9 +18,6 @@ with open("data/models/list.json", "r") as f:
     data = ujson.load(f)
     model_max_tokens = {model['id']: model.get('max_tokens') for model in data['data']}
 
-with open("data/models/bad_models.json", "r") as f:
-    bad_models = ujson.load(f)
-
 class AnthropicChatBody(BaseModel):
     model: str
     messages: List[Dict]
@@ -0,0 +1,77 @@
+from dataclasses import dataclass
+
+from fastapi import Request
+
+from api.database import DatabaseManager
+from api.config import subscription_types
+
+PREMIUM_TIERS = ['basic', 'premium', 'custom']
+
+@dataclass
+class AuthContext:
+    """Everything a request needs to know about its caller, resolved once per request."""
+    key: str
+    user_id: str | None = None  # the legacy key for users that only have a top-level key
+    found: bool = False
+    banned: bool = False
+    subscription_type: str = "free"
+    rate_limit: int = 0
+    credit_limit: int = 0
+
+    @property
+    def valid(self) -> bool:
+        """Whether the key belongs to a user."""
+        return self.found
+
+    @property
+    def premium(self) -> bool:
+        return self.subscription_type in PREMIUM_TIERS
+
+    @classmethod
+    def from_user(cls, key: str, user: dict | None) -> "AuthContext":
+        """Builds a context from a projected user document."""
+        if not user:
+            return cls(key=key)
+
+        subscription_type = user.get("subscription_type", "free")
+
+        if subscription_type == "custom":
+            rate_limit = user.get("rate_limit", 0)
+            credit_limit = user.get("credit_limit", 0)
+        else:
+            try:
+                rate_limit = subscription_types[subscription_type]['rate_limit']
+                credit_limit = subscription_types[subscription_type]['credits']
+            except KeyError:
+                print(f"Invalid subscription type: {subscription_type} for user: {user.get('user_id')}")
+                rate_limit, credit_limit = 0, 0
+
+        return cls(
+            key=key,
+            user_id=user.get("user_id") or user.get("key"),
+            found=True,
+            banned=user.get("banned", False),
+            subscription_type=subscription_type,
+            rate_limit=rate_limit,
+            credit_limit=credit_limit
+        )
+
+def get_key(request: Request) -> str:
+    return request.headers.get("Authorization", "").replace("Bearer ", "")
+
+async def get_auth_context(request: Request) -> AuthContext:
+    """Returns the request's AuthContext, resolving it from the database on first use.
+
+    The context is stored on `request.state.auth` so checks, routes and accounting
+    calls share a single lookup.
+    """
+    context = getattr(request.state, "auth", None)
+    if context is not None:
+        return context
+
+    key = get_key(request)
+    user = await DatabaseManager.get_auth_user(key)
+
+    context = AuthContext.from_user(key, user)
+    request.state.auth = context
+    return context
@@ -0,0 +1,49 @@
+import os
+
+import ujson
+
+BAD_MODELS_PATH = "data/models/bad_models.json"
+
+def _read() -> list[str]:
+    try:
+        with open(BAD_MODELS_PATH, "r") as f:
+            return [model.lower() for model in ujson.load(f)]
+    except (OSError, ValueError) as e:
+        print(f"Error reading bad models: {e}")
+        return []
+
+def _mtime() -> int:
+    try:
+        return os.stat(BAD_MODELS_PATH).st_mtime_ns
+    except OSError:
+        return 0
+
+# models that are down, checked by the chat schemas; updated in place so every importer sees changes
+bad_models: list[str] = _read()
+_file_models: list[str] = list(bad_models)  # the ones in bad_models.json, put there by hand
+_auto_models: set[str] = set()  # the ones the provider health checker took down, kept in Redis only
+_loaded_mtime = _mtime()
+
+def _update() -> None:
+    bad_models[:] = _file_models + sorted(_auto_models.difference(_file_models))
+
+def reload_bad_models() -> None:
+    """Picks up changes a person made to the file."""
+    global _loaded_mtime, _file_models
+    mtime = _mtime()
+    if mtime != _loaded_mtime:
+        _file_models = _read()
+        _loaded_mtime = mtime
+        _update()
+
+def set_auto_bad_models(models) -> None:
+    """Replaces the models the health checker marked as down, the file is never written.
+
+    Args:
+        models: Every model the health checker currently considers down.
+    """
+    global _auto_models
+    models = {model.lower() for model in models}
+    if models != _auto_models:
+        _auto_models = models
+        _update()
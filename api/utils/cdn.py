@@ -6,10 +6,11 @@ import base64
 from datetime import datetime, timedelta
 
 import aiofiles
-import aiohttp
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
+from api.utils.http import http_clients
+
 images_dir = Path('cdn/images')
 speech_dir = Path('cdn/speech')
 images_dir.mkdir(parents=True, exist_ok=True)
@@ -55,28 +56,27 @@ async def url_to_cdn(url: str) -> Tuple[Optional[str], bool]:
     try:
         file_url = None
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                response.raise_for_status()
+        async with http_clients.session("cdn").get(url) as response:
+            response.raise_for_status()
 
-                content_type = response.headers.get("Content-Type", '')
+            content_type = response.headers.get("Content-Type", '')
 
-                if content_type == 'image/webp':
-                    file_extension = '.webp'
-                else:
-                    file_extension = mimetypes.guess_extension(content_type) or '.bin'
+            if content_type == 'image/webp':
+                file_extension = '.webp'
+            else:
+                file_extension = mimetypes.guess_extension(content_type) or '.bin'
 
-                if content_type.startswith('image/'):
-                    save_dir = images_dir
-                else:
-                    save_dir = speech_dir
+            if content_type.startswith('image/'):
+                save_dir = images_dir
+            else:
+                save_dir = speech_dir
 
-                filename = f"{uuid4()}{file_extension}"
-                file_path = save_dir / filename
+            filename = f"{uuid4()}{file_extension}"
+            file_path = save_dir / filename
 
-                async with aiofiles.open(file_path, 'wb') as out_file:
-                    while chunk := await response.content.read(1024):
-                        await out_file.write(chunk)
+            async with aiofiles.open(file_path, 'wb') as out_file:
+                while chunk := await response.content.read(1024):
+                    await out_file.write(chunk)
 
         file_url = f"https://api.shard-ai.xyz/cdn/{save_dir.name}/{filename}"
         return (file_url, True)
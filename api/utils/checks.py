@@ -1,21 +1,18 @@
-from redis_rate_limit import RateLimit, TooManyRequests
 from fastapi.exceptions import HTTPException
 from fastapi import Request
 
 from api.database import DatabaseManager, ModelManager
-from api.utils.redis_manager import RateLimited, check_rate_limit
-from api.config import subscription_types
+from api.utils.redis_manager import RateLimited, RequestPipeline, check_rate_limit
+from api.utils.auth import AuthContext, get_auth_context
 
 async def user_checks(request: Request):
-    key = request.headers.get("Authorization", "").replace("Bearer ", "")
+    auth = await get_auth_context(request)
+    key = auth.key
     origin = (
         request.headers.get("HTTP-Referer", "")
         or request.headers.get("Referer", "")
         or request.headers.get("Origin", "")
     )
-    
-    subscription_type = await DatabaseManager.get_subscription_type(key)
-    premium: bool = (subscription_type in ['basic', 'premium', 'custom'])
 
     if key == "":
         raise HTTPException(
@@ -30,9 +27,7 @@ async def user_checks(request: Request):
             status_code=401,
         )
 
-    key_check, _ = await DatabaseManager.key_check(key)
-
-    if not key_check:
+    if not auth.valid:
         raise HTTPException(
             detail={
                 "error": {
@@ -45,7 +40,7 @@ async def user_checks(request: Request):
             status_code=401,
         )
 
-    if await DatabaseManager.ban_check(key):
+    if auth.banned:
         raise HTTPException(
             detail={
                 "error": {
@@ -67,15 +62,24 @@ async def user_checks(request: Request):
         data = await request.json()
         model = data.get('model')
     
-    await ModelManager.update_model_usage(model, await DatabaseManager.get_id(key))
+    await ModelManager.update_model_usage(model, auth.user_id)
 
+    # the credit charge and the rate limit check share one round-trip, rate_limit() reuses the result
+    pipeline = RequestPipeline()
+    charge, limit = await pipeline.gather(
+        DatabaseManager.charge_request(auth.user_id, auth.credit_limit, model, pipeline=pipeline),
+        _check_rate_limit(request, auth, pipeline),
+        return_exceptions=True
+    )
+    if isinstance(charge, Exception):
+        raise charge
 
-    daily_usage, usage, limit, history = await DatabaseManager.get_daily_usage(key)
-    if daily_usage >= limit:
+    allowed, remaining, reset = charge
+    if not allowed:
         raise HTTPException(
             detail={
                 "error": {
-                    "message": "Daily limit exceeded, please wait for the reset.",
+                    "message": f"Daily limit exceeded, please wait for the reset in {reset} seconds.",
                     "type": "error",
                     "param": None,
                     "code": None,
@@ -84,32 +88,43 @@ async def user_checks(request: Request):
             status_code=429,
         )
 
-    await DatabaseManager.update_daily_usage(key, model if model is not None else None)    
-    await DatabaseManager.usage_update(key, model if model is not None else None)
+    if isinstance(limit, Exception):
+        raise limit
 
 async def rate_limit(request: Request):
-    key = request.headers.get("Authorization", "").replace("Bearer ", "")
+    # already checked by user_checks
+    if getattr(request.state, "rate_limit_headers", None) is not None:
+        return
 
-    subscription = await DatabaseManager.get_subscription_type(key)
-    key_check, _ = await DatabaseManager.key_check(key)
+    auth = await get_auth_context(request)
 
-    if subscription == 'custom':
-        user_rate_limit, _ = await DatabaseManager.get_custom_subscription_values(key)
-    else:
-        user_rate_limit = subscription_types[subscription]['rate_limit']
+    if auth.valid:
+        await _check_rate_limit(request, auth)
 
-    if key_check:
-        try:
-            await check_rate_limit(key, user_rate_limit)
-        except RateLimited as e:
-            raise HTTPException(
-                detail={
-                    "error": {
-                        "message": f"{e.error}",
-                        "type": "error",
-                        "param": None,
-                        "code": None,
-                    }
-                },
-                status_code=429,
-            )
\ No newline at end of file
+async def _check_rate_limit(request: Request, auth: AuthContext, pipeline: RequestPipeline | None = None):
+    # picked up by the RateLimitHeaders middleware, which adds them to the response
+    try:
+        _, remaining, reset = await check_rate_limit(auth.key, auth.rate_limit, pipeline=pipeline)
+        request.state.rate_limit_headers = {
+            "X-RateLimit-Limit": str(auth.rate_limit),
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset": str(reset),
+        }
+    except RateLimited as e:
+        request.state.rate_limit_headers = {
+            "X-RateLimit-Limit": str(auth.rate_limit),
+            "X-RateLimit-Remaining": "0",
+            "X-RateLimit-Reset": str(e.retry_after),
+            "Retry-After": str(e.retry_after),
+        }
+        raise HTTPException(
+            detail={
+                "error": {
+                    "message": f"{e.error}",
+                    "type": "error",
+                    "param": None,
+                    "code": None,
+                }
+            },
+            status_code=429,
+        )
\ No newline at end of file
@@ -0,0 +1,158 @@
+from collections import deque
+from typing import Callable
+import time
+
+from api.config import config
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+WINDOW: int = getattr(config, 'breaker_window', 20)  # recent calls the thresholds are computed over
+MIN_CALLS: int = getattr(config, 'breaker_min_calls', 5)
+ERROR_THRESHOLD: float = getattr(config, 'breaker_error_threshold', 0.5)
+LATENCY_THRESHOLD: float = getattr(config, 'breaker_latency_threshold', 60.0)  # seconds, mean over the window (time to first token for streams)
+BASE_BACKOFF: float = getattr(config, 'breaker_base_backoff', 10.0)
+MAX_BACKOFF: float = getattr(config, 'breaker_max_backoff', 300.0)
+
+def get_retry_after(obj) -> float | None:
+    """Finds an upstream Retry-After (or a bare 429) on an exception or response, in seconds."""
+    response = getattr(obj, "response", None) or obj
+    status = getattr(response, "status_code", None) or getattr(response, "status", None) or getattr(obj, "status_code", None)
+    headers = getattr(response, "headers", None) or getattr(obj, "headers", None) or {}
+
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    if value is not None:
+        try:
+            return max(float(value), 0.0)
+        except (TypeError, ValueError):
+            pass
+    if status == 429:
+        return BASE_BACKOFF
+    return None
+
+class CircuitBreaker:
+    """Breaker for one provider serving one model.
+
+    Closed: every request goes through, the outcome of the last WINDOW calls is kept.
+    Open: no requests until the backoff ends, doubling each time it opens in a row.
+    Half-open: a single probe request is let through, success closes the breaker and
+    failure opens it again.
+    """
+    __slots__ = ("state", "outcomes", "opened", "open_until", "probing", "probe_started")
+
+    def __init__(self):
+        self.state = CLOSED
+        self.outcomes: deque[tuple[bool, float]] = deque(maxlen=WINDOW)  # (error, latency)
+        self.opened = 0  # times opened in a row, for the backoff
+        self.open_until = 0.0
+        self.probing = False
+        self.probe_started = 0.0
+
+    def available(self) -> bool:
+        """Whether a request could be sent now, without claiming the half-open probe."""
+        if self.state == OPEN and time.monotonic() >= self.open_until:
+            self.state = HALF_OPEN
+            self.probing = False
+        if self.state == HALF_OPEN:
+            # a probe that never reported back (e.g. a stream nobody read) doesn't block forever
+            return not self.probing or time.monotonic() - self.probe_started > LATENCY_THRESHOLD
+        return self.state == CLOSED
+
+    def acquire(self) -> None:
+        """Called for the provider that was picked, claims the probe when half-open."""
+        if self.state == HALF_OPEN:
+            self.probing = True
+            self.probe_started = time.monotonic()
+
+    def record(self, error: bool, latency: float, retry_after: float | None = None) -> None:
+        if self.state == HALF_OPEN:
+            if error:
+                self.open(retry_after)
+            else:
+                self.close()
+            return
+
+        self.outcomes.append((error, latency))
+        if retry_after is not None:
+            self.open(retry_after)
+            return
+
+        if len(self.outcomes) >= MIN_CALLS:
+            error_rate = sum(1 for failed, _ in self.outcomes if failed) / len(self.outcomes)
+            latencies = [latency for failed, latency in self.outcomes if not failed]
+            mean_latency = sum(latencies) / len(latencies) if latencies else 0.0
+            if error_rate >= ERROR_THRESHOLD or mean_latency >= LATENCY_THRESHOLD:
+                self.open()
+
+    def open(self, retry_after: float | None = None) -> None:
+        backoff = min(BASE_BACKOFF * (2 ** self.opened), MAX_BACKOFF)
+        if retry_after is not None:
+            backoff = max(backoff, retry_after)
+
+        self.state = OPEN
+        self.opened += 1
+        self.open_until = time.monotonic() + backoff
+        self.probing = False
+        self.outcomes.clear()
+
+    def release(self) -> None:
+        """Gives the half-open probe back without an outcome, e.g. when the call was cancelled."""
+        self.probing = False
+
+    def close(self) -> None:
+        self.state = CLOSED
+        self.opened = 0
+        self.probing = False
+        self.outcomes.clear()
+
+class CircuitBreakers:
+    """Circuit breakers per (provider, model).
+
+    Listeners are called with (provider, model, available, open_until) when a breaker
+    opens or closes, the move from open to half-open is left to them to poll.
+    """
+    def __init__(self):
+        self._breakers: dict[tuple[str, str], CircuitBreaker] = {}
+        self.listeners: list[Callable[[str, str, bool, float], None]] = []
+
+    def get(self, provider: str, model: str) -> CircuitBreaker:
+        breaker = self._breakers.get((provider, model))
+        if breaker is None:
+            breaker = self._breakers[(provider, model)] = CircuitBreaker()
+        return breaker
+
+    def available(self, provider: str, model: str) -> bool:
+        return self.get(provider, model).available()
+
+    def acquire(self, provider: str, model: str) -> None:
+        self.get(provider, model).acquire()
+
+    def record(self, provider: str, model: str, error: bool, latency: float, retry_after: float | None = None) -> None:
+        breaker = self.get(provider, model)
+        was_open = breaker.state == OPEN
+        breaker.record(error, latency, retry_after)
+        self._notify(provider, model, breaker, was_open)
+
+    def release(self, provider: str, model: str) -> None:
+        self.get(provider, model).release()
+
+    def _notify(self, provider: str, model: str, breaker: CircuitBreaker, was_open: bool) -> None:
+        is_open = breaker.state == OPEN
+        if is_open == was_open and not is_open:
+            return
+        for listener in self.listeners:
+            listener(provider, model, not is_open, breaker.open_until)
+
+    def stats(self) -> dict[str, dict]:
+        now = time.monotonic()
+        return {
+            f"{provider}|{model}": {
+                "state": breaker.state,
+                "opened": breaker.opened,
+                "retry_in": round(max(breaker.open_until - now, 0), 1) if breaker.state == OPEN else 0
+            }
+            for (provider, model), breaker in self._breakers.items()
+        }
+
+circuit_breakers = CircuitBreakers()
@@ -0,0 +1,116 @@
+from urllib.parse import urlsplit
+import asyncio
+
+from curl_cffi.requests import AsyncSession
+import aiohttp
+
+from api.config import config
+
+POOL_SIZE: int = getattr(config, 'http_pool_size', 100)  # connections per session
+POOL_SIZE_PER_HOST: int = getattr(config, 'http_pool_size_per_host', 20)
+KEEPALIVE_TIMEOUT: float = getattr(config, 'http_keepalive_timeout', 60)  # seconds an idle connection is kept
+DNS_CACHE_TTL: int = getattr(config, 'http_dns_cache_ttl', 300)
+REQUEST_TIMEOUT: float | None = getattr(config, 'http_timeout', None)  # total seconds per request, unset keeps aiohttp's 5 minute default
+PREWARM_HOSTS: dict[str, list[str]] | list[str] = getattr(config, 'http_prewarm', None) or {}  # {session name: [urls]} or urls for the default session
+
+class HTTPClients:
+    """Process wide HTTP sessions, shared by name so connections are reused across calls.
+
+    `session(name)` is an aiohttp session with a keep-alive pool per host and a DNS cache.
+    `curl_session(name)` is a curl_cffi session for callers that need browser
+    impersonation, it negotiates HTTP/2 where the server supports it. Providers can ask
+    for their own named session to keep their pool apart from everyone else's.
+    """
+    def __init__(self):
+        self._sessions: dict[str, aiohttp.ClientSession] = {}
+        self._curl_sessions: dict[str, AsyncSession] = {}
+
+    def session(self, name: str = "default", **kwargs) -> aiohttp.ClientSession:
+        """The shared aiohttp session called `name`, created on first use.
+
+        Args:
+            name: The session's name, e.g. "webhooks" or a provider's name.
+            **kwargs: Extra ClientSession arguments, only used when the session is created,
+                e.g. a `timeout` for this session alone.
+
+        Returns:
+            aiohttp.ClientSession: The session, don't close it.
+        """
+        session = self._sessions.get(name)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=POOL_SIZE,
+                limit_per_host=POOL_SIZE_PER_HOST,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=DNS_CACHE_TTL,
+                use_dns_cache=True
+            )
+            if REQUEST_TIMEOUT is not None:
+                kwargs.setdefault("timeout", aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+            session = self._sessions[name] = aiohttp.ClientSession(connector=connector, **kwargs)
+        return session
+
+    def curl_session(self, name: str = "default", impersonate: str = "chrome107") -> AsyncSession:
+        """The shared curl_cffi session called `name`, created on first use."""
+        session = self._curl_sessions.get(name)
+        if session is None:
+            session = self._curl_sessions[name] = AsyncSession(impersonate=impersonate, max_clients=POOL_SIZE_PER_HOST)
+        return session
+
+    async def prewarm(self, hosts: dict[str, list[str]] | list[str] | None = None) -> None:
+        """Opens a connection to each host ahead of the first real request.
+
+        Args:
+            hosts: {session name: [urls]}, or urls for the default session.
+                Defaults to the `http_prewarm` config.
+        """
+        hosts = PREWARM_HOSTS if hosts is None else hosts
+        if isinstance(hosts, list):
+            hosts = {"default": hosts}
+
+        async def warm(name: str, url: str) -> None:
+            parts = urlsplit(url)
+            try:
+                async with self.session(name).head(f"{parts.scheme}://{parts.netloc}/", allow_redirects=False) as _:
+                    pass
+            except Exception as e:
+                print(f"Error prewarming {parts.netloc}: {e}")
+
+        await asyncio.gather(*(warm(name, url) for name, urls in hosts.items() for url in urls))
+
+    def stats(self) -> dict[str, dict]:
+        stats = {}
+        for name, session in self._sessions.items():
+            connector = session.connector
+            idle = getattr(connector, "_conns", {})
+            stats[name] = {
+                "closed": session.closed,
+                "limit": connector.limit if connector else 0,
+                "limit_per_host": connector.limit_per_host if connector else 0,
+                "in_use": len(getattr(connector, "_acquired", ())),
+                "idle": sum(len(conns) for conns in idle.values()),
+                "hosts": len(idle)
+            }
+        for name in self._curl_sessions:
+            stats[f"curl:{name}"] = {"closed": False}
+        return stats
+
+    async def close_session(self, name: str) -> None:
+        """Closes the aiohttp session called `name`, the next `session(name)` opens a new one."""
+        session = self._sessions.pop(name, None)
+        if session is not None and not session.closed:
+            await session.close()
+
+    async def close(self) -> None:
+        for session in self._sessions.values():
+            if not session.closed:
+                await session.close()
+        for session in self._curl_sessions.values():
+            try:
+                await session.close()
+            except Exception as e:
+                print(f"Error closing curl session: {e}")
+        self._sessions.clear()
+        self._curl_sessions.clear()
+
+http_clients = HTTPClients()
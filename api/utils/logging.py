@@ -7,9 +7,9 @@ import time
 import os
 
 from colorama import Fore
-import aiohttp
 import ujson
 
+from api.utils.http import http_clients
 from api.config import config
 
 WEBHOOK_URL: str = config.discord_webhook_url
@@ -104,10 +104,9 @@ async def log_req(status: bool, time: float, model: str, user: str, response: st
     if url:
         embed["image"] = {"url": url}
 
-    async with aiohttp.ClientSession() as session:
-        webhook = {"embeds": [embed]}
-        async with session.post(WEBHOOK_URL, json=webhook) as response:
-            pass
+    webhook = {"embeds": [embed]}
+    async with http_clients.session("webhooks").post(WEBHOOK_URL, json=webhook) as response:
+        pass
 
 async def print_status(status: bool, response_time: float, model: str, user: str, response: str = None, provider=None):
     print(
@@ -138,10 +137,9 @@ async def log_info(message, reason, status, user, input_: str = None):
         "timestamp": datetime.utcnow().isoformat(),
     }
     
-    async with aiohttp.ClientSession() as session:
-        webhook = {"embeds": [embed]}
-        async with session.post(WEBHOOK_URL, json=webhook) as _:
-            pass
+    webhook = {"embeds": [embed]}
+    async with http_clients.session("webhooks").post(WEBHOOK_URL, json=webhook) as _:
+        pass
         
         
 async def stripe_logging(event_type: str, status: str, details: dict = None, error: str = None):
@@ -210,7 +208,6 @@ async def stripe_logging(event_type: str, status: str, details: dict = None, err
     if error:
         embed["fields"].append({"name": "❌ Error", "value": f"`{error}`", "inline": False})
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(STRIPE_WEBHOOK_URL, json={"embeds": [embed]}) as response:
-            if response.status != 204:
-                print(f"{Fore.RED}Error sending Discord webhook: {await response.text()}{Fore.RESET}")
\ No newline at end of file
+    async with http_clients.session("webhooks").post(STRIPE_WEBHOOK_URL, json={"embeds": [embed]}) as response:
+        if response.status != 204:
+            print(f"{Fore.RED}Error sending Discord webhook: {await response.text()}{Fore.RESET}")
\ No newline at end of file
@@ -1,70 +1,29 @@
-import importlib
 import inspect
-import time
-import sys
-import os
+import asyncio
+import copy
 
+from api.utils.circuit_breaker import circuit_breakers, get_retry_after
+from api.utils.provider_stats import provider_stats, current_call, stream_capture
+from api.utils.provider_manager.concurrency import provider_limits, ProviderBusy
+from api.utils.provider_manager.hedging import hedge_policy
+from api.utils.provider_manager.health import HealthChecker
+from api.utils.provider_manager.registry import ProviderRegistry
+from api.utils.provider_manager.plugins import plugins
+from api.utils.provider_manager.quota import quota_leases
 from api.database import ProviderManager
 from api.utils.logging import logger
 from api.config import config
 
-base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
-sys.path.insert(0, base_dir)
-provider_dir = os.path.join(base_dir, 'providers', 'chat')
-
 DEBUG = config.debug
-PROVIDERS = {}  # Will store {model: [{"stream": bool, "obj": provider_instance}, ...]}
-ROUND_ROBIN_INDEX = {}
-TIMED_OUT_PROVIDERS = {}
-TIMEOUT_DURATION = 300
+PROVIDERS = ProviderRegistry(lambda model: plugins.load("chat", model))
+plugins.listeners.append(PROVIDERS.reset)
+STREAM_FAILOVERS: dict[str, dict[str, int]] = {}  # {provider: {"broken": n, "resumed": n}}
+NO_CAPTURE: set[str] = set()  # providers whose streams can't be taken over, they don't use stream_response_iterator_str_generator
+health_checker = HealthChecker(PROVIDERS, lambda provider, model, data: Utils.canary(provider, model, data))
 
 try:
     with open("/tmp/api_initialized_chat (1).flag", 'x') as _:
-        logger("Loading chat providers...")
-except:
-    pass
-
-for root, _, files in os.walk(provider_dir):
-    for file in files:
-        if file.endswith('.py') and file != '__init__.py':
-            relative_path = os.path.relpath(root, base_dir)
-            module_name = os.path.join(relative_path, file[:-3]).replace(os.sep, '.')
-            if "deprecated" in module_name:
-                continue
-            module = importlib.import_module(module_name)
-            for name, obj in inspect.getmembers(module):
-                if inspect.isclass(obj):
-                    has_models = hasattr(obj, 'models')
-                    has_generate = hasattr(obj, 'generate')
-                    has_check = hasattr(obj, 'check')
-                    if has_models and has_generate and has_check:
-                        provider = obj()
-                        working = getattr(provider, 'working', True)
-                        if working:
-                            provider_models = getattr(provider, 'models', [])
-                            can_stream = getattr(provider, 'stream', False)
-                            limit = getattr(provider, 'limit', None)
-                            
-                            if provider.working is False:
-                                continue
-
-                            for model in provider_models:
-                                if model not in PROVIDERS:
-                                    PROVIDERS[model] = []
-                                    ROUND_ROBIN_INDEX[model] = 0
-                                
-                                provider_info = {
-                                    "stream": can_stream, # whether or not the provider can stream
-                                    "obj": provider, # the provider class obj
-                                    "limit": limit # daily limit of requests that can be sent
-                                }
-                                
-                                if provider_info not in PROVIDERS[model]:
-                                    PROVIDERS[model].append(provider_info)
-
-try:
-    with open("/tmp/api_initialized_chat (2).flag", 'x') as _:
-        logger(f"Loaded {len(PROVIDERS)} models with {len(set(p['obj'] for providers in PROVIDERS.values() for p in providers))} unique chat providers!")
+        logger(f"Found {len(plugins.models('chat'))} models with {plugins.provider_count('chat')} unique chat providers!")
 except:
     pass
 
@@ -72,109 +31,306 @@ class Utils:
     """Utility class providing provider management."""
 
     @staticmethod
-    async def get_next_provider(model: str, require_stream: bool = False):
+    async def get_next_provider(model: str, require_stream: bool = False, exclude: set | None = None):
         """
-        Get the next available provider for a given model using round-robin selection.
-        Checks usage limits and updates provider usage when applicable.
+        Get the next available provider for a given model using power-of-two-choices
+        on the providers' latency, error rate and in-flight requests (see provider_stats).
+        Spends a call of the provider's daily limit and claims its half-open breaker probe,
+        `generate` gives both back if the provider turns out to be busy.
 
         Args:
             model: The model identifier to get a provider for
             require_stream: Whether streaming capability is required
+            exclude: Provider instances that must not be picked
 
         Returns:
             A provider instance or None if no providers are available
         """
-        providers = PROVIDERS.get(model, [])
-        available_providers = [
-            p for p in providers 
-            if not Utils.is_provider_timed_out(p["obj"]) and
-            (not require_stream or p["stream"])
-        ]
+        available_providers = PROVIDERS.candidates(model, require_stream, exclude)
         
-        if not available_providers:
-            return None
+        while available_providers:
+            record = provider_stats.choose(available_providers, model, require_stream)
+            available_providers.remove(record)
 
-        if model not in ROUND_ROBIN_INDEX or ROUND_ROBIN_INDEX[model] >= len(available_providers):
-            ROUND_ROBIN_INDEX[model] = 0
+            # a half-open breaker lets one probe through, a saturated provider has no queue left
+            if not circuit_breakers.available(record.name, model) or provider_limits.saturated(record.obj):
+                continue
             
-        original_index = ROUND_ROBIN_INDEX[model]
-        index = original_index
+            # usually served from this worker's lease, without any I/O
+            if record.limit is None or await quota_leases.acquire(record.name, record.limit):
+                circuit_breakers.acquire(record.name, model)
+                return record.obj
         
-        for _ in range(len(available_providers)):
-            provider_info = available_providers[index]
-            provider = provider_info["obj"]
-            limit = provider_info["limit"]
-            
-            if limit is None:
-                ROUND_ROBIN_INDEX[model] = (index + 1) % len(available_providers)
-                await ProviderManager.update_provider_usage(provider.__class__.__name__)
-                return provider
-            
-            usage = await ProviderManager.get_provider_usage_today(provider.__class__.__name__)
-            if usage is None:
-                usage = 0
-                
-            if usage < limit:
-                success = await ProviderManager.update_provider_usage(provider.__class__.__name__)
-                if not success:
-                    logger(f"Failed to update usage for provider {provider.__class__.__name__}")
-                
-                ROUND_ROBIN_INDEX[model] = (index + 1) % len(available_providers)
-                return provider
+        return None
+
+    @staticmethod
+    async def check_provider(provider, data: dict) -> bool:
+        """
+        Run a provider's check against the request, which can be sync or async. Providers
+        with `check_in_background = True` have a request independent check, the health
+        checker runs it instead.
+        
+        Args:
+            provider: The provider instance
+            data: The request data
             
-            index = (index + 1) % len(available_providers)
+        Returns:
+            bool: True if the provider can handle the request
+        """
+        if getattr(provider, 'check_in_background', False):
+            return True
+        if inspect.iscoroutinefunction(provider.check):
+            return await provider.check(data)
+        return provider.check(data)
+
+    @staticmethod
+    async def unpick(provider, model: str, probe: bool = True) -> None:
+        """
+        Give back what picking a provider spent, for a request that was never sent to it.
+        
+        Args:
+            provider: The provider instance
+            model: The model identifier
+            probe: Whether to release the breaker probe get_next_provider claimed
+        """
+        name = provider.__class__.__name__
+        if probe:
+            circuit_breakers.release(name, model)
+        if getattr(provider, 'limit', None) is not None:
+            await quota_leases.refund(name)
+
+    @staticmethod
+    async def generate(provider, model: str, data: dict, stream: bool, key: str, picked: bool = True):
+        """
+        Send a request to a provider, recording its latency and outcome in provider_stats
+        and its circuit breaker. Streams made with the helpers in api.utils.responses are
+        finished by them once they end.
+        Providers with a `max_concurrency` hold a slot until then, waiting for one if needed.
+        Provider usage is only counted once the request is actually sent.
+        
+        Args:
+            provider: The provider instance
+            model: The model identifier
+            data: The request data
+            stream: Whether to stream the response
+            key: API key or authentication token
+            picked: Whether get_next_provider picked the provider, and so claimed its breaker probe
             
-            if index == original_index:
-                break
+        Returns:
+            The provider's response
+
+        Raises:
+            ProviderBusy: If the provider had no free slot within its queue timeout
+        """
+        name = provider.__class__.__name__
+        limiter = provider_limits.get(provider)
+        try:
+            acquired = limiter is None or await limiter.acquire()
+        except asyncio.CancelledError:
+            if picked:
+                circuit_breakers.release(name, model)
+            raise
+        if not acquired:
+            # nothing was sent, so the breaker probe and the quota call go back for the next request
+            await Utils.unpick(provider, model, probe=picked)
+            raise ProviderBusy(name)
+        await ProviderManager.update_provider_usage(name)
+
+        call = provider_stats.start(name, model)
+        if limiter is not None:
+            call.on_finish.append(limiter.release)
+        # a reload closes a replaced provider only after this call is done
+        plugins.acquire(provider)
+        call.on_finish.append(lambda: plugins.release(provider))
+        token = current_call.set(call)
+        try:
+            response = await provider.generate(
+                data,
+                stream,
+                key
+            )
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except Exception as e:
+            call.finish(error=True, retry_after=get_retry_after(e))
+            raise
+        finally:
+            current_call.reset(token)
+
+        if not call.streaming:
+            # a stream made without the response helpers can't be followed, finish it
+            # now but keep its time to headers out of the non-stream latencies
+            call.streaming = stream
+            status = getattr(response, "status_code", 200)
+            call.finish(error=response is None or status >= 500 or status == 429, retry_after=get_retry_after(response))
+        elif call.failover is None:
+            call.failover = lambda partial: Utils.failover_stream(model, data, key, partial, {provider}, provider)
+        return response
+
+    @staticmethod
+    async def canary(provider, model: str, data: dict) -> bool | None:
+        """
+        Send a health check completion, charged to the provider's quota and held to its
+        concurrency limit like any other request.
         
-        return None
+        Args:
+            provider: The provider instance
+            model: The model identifier
+            data: The request data
+            
+        Returns:
+            bool | None: Whether the provider answered, None if it had no quota or free slot for it
+        """
+        name = provider.__class__.__name__
+        limit = getattr(provider, 'limit', None)
+        if limit is not None and not await quota_leases.acquire(name, limit):
+            return None
+
+        try:
+            response = await Utils.generate(provider, model, data, False, "", picked=False)
+        except ProviderBusy:
+            return None
+        except Exception:
+            return False
+        return response is not None and getattr(response, "status_code", 200) < 400
 
     @staticmethod
-    def is_provider_timed_out(provider) -> bool:
+    async def failover_stream(model: str, data: dict, key: str, partial: str, exclude: set, failed):
         """
-        Check if a provider is currently timed out.
+        Re-issue a stream that broke to another provider, with the content the client
+        already received as an assistant prefix to continue from.
         
         Args:
-            provider: The provider instance to check
+            model: The model identifier
+            data: The original request data
+            key: API key or authentication token
+            partial: The content streamed so far
+            exclude: Providers that already failed this request
+            failed: The provider whose stream broke
             
         Returns:
-            bool: True if the provider is timed out, False otherwise
+            tuple: (raw stream, ProviderCall) of the new provider, or None if none could take over
         """
-        if provider in TIMED_OUT_PROVIDERS:
-            if time.time() > TIMED_OUT_PROVIDERS[provider]:
-                del TIMED_OUT_PROVIDERS[provider]
-                return False
-            return True
-        return False
+        failed_name = failed.__class__.__name__
+        STREAM_FAILOVERS.setdefault(failed_name, {"broken": 0, "resumed": 0})["broken"] += 1
+
+        resumed_data = copy.deepcopy(data)
+        if partial:
+            resumed_data["messages"].append({"role": "assistant", "content": partial})
+
+        # don't spend quota on providers whose stream would have to be thrown away
+        exclude.update(record.obj for record in PROVIDERS.candidates(model, require_stream=True) if record.name in NO_CAPTURE)
+
+        capture = []
+        token = stream_capture.set(capture)
+        try:
+            provider = await Utils.get_next_provider(model, require_stream=True, exclude=exclude)
+            while provider:
+                exclude.add(provider)
+                response = None
+                try:
+                    if not await Utils.check_provider(provider, resumed_data):
+                        await Utils.unpick(provider, model)
+                        provider = await Utils.get_next_provider(model, require_stream=True, exclude=exclude)
+                        continue
+                    response = await Utils.generate(provider, model, resumed_data, True, key)
+                except Exception as e:
+                    if DEBUG:
+                        print(f"Stream failover from {failed_name} to {provider.__class__.__name__} failed: {e}")
+                if capture:
+                    message, call = capture[0]
+                    if call is not None:
+                        # the next failover starts again from the original request, with everything streamed by then
+                        call.failover = lambda partial: Utils.failover_stream(model, data, key, partial, exclude, provider)
+                    STREAM_FAILOVERS.setdefault(provider.__class__.__name__, {"broken": 0, "resumed": 0})["resumed"] += 1
+                    if DEBUG:
+                        print(f"Stream for {model} failed over from {failed_name} to {provider.__class__.__name__} after {len(partial)} characters")
+                    return message, call
+
+                body = getattr(response, "body_iterator", response)
+                if hasattr(body, "aclose"):
+                    # it streamed some other way, stop reading it and leave the provider out next time
+                    NO_CAPTURE.add(provider.__class__.__name__)
+                    try:
+                        await body.aclose()
+                    except Exception as e:
+                        if DEBUG:
+                            print(f"Error closing {provider.__class__.__name__} stream: {e}")
+                provider = await Utils.get_next_provider(model, require_stream=True, exclude=exclude)
+        finally:
+            stream_capture.reset(token)
+
+        if DEBUG:
+            print(f"Stream for {model} broke on {failed_name} and no provider could take over")
+        return None
 
     @staticmethod
-    def timeout_provider(provider):
+    async def hedged_generate(provider, model: str, data: dict, key: str, delay: float):
         """
-        Mark a provider as timed out for the configured timeout duration.
+        Send a non-stream request, and a second one to another provider if the first
+        hasn't answered within `delay` seconds. The first usable answer wins and the
+        other request is cancelled.
         
         Args:
-            provider: The provider instance to timeout
+            provider: The provider instance for the first request
+            model: The model identifier
+            data: The request data
+            key: API key or authentication token
+            delay: Seconds to wait before hedging
+            
+        Returns:
+            The winning provider's response
         """
-        TIMED_OUT_PROVIDERS[provider] = time.time() + TIMEOUT_DURATION
+        primary = asyncio.create_task(Utils.generate(provider, model, data, False, key))
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not hedge_policy.can_hedge():
+                return await primary
+
+            hedge_provider = await Utils.get_next_provider(model, exclude={provider})
+            if hedge_provider is None:
+                return await primary
+            if not await Utils.check_provider(hedge_provider, data):
+                await Utils.unpick(hedge_provider, model)
+                return await primary
+
+            if DEBUG:
+                print(f"Hedging {provider.__class__.__name__} with {hedge_provider.__class__.__name__} for model: {model}")
+
+            hedge_policy.spend()
+            hedge = asyncio.create_task(Utils.generate(hedge_provider, model, copy.deepcopy(data), False, key))
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result() is not None:
+                        hedge_policy.record_winner(task is hedge)
+                        return task.result()
+
+            # neither answered, fail the same way an unhedged request would
+            return await primary
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
 
     @staticmethod
     def get_provider_info(model: str, provider_obj):
         """
-        Get provider info dictionary from the providers list for a given model and provider object.
+        Get the registry record of a provider object for a given model.
         
         Args:
             model: The model identifier
             provider_obj: The provider instance to find
             
         Returns:
-            dict: Provider info dictionary or None if not found
+            ProviderRecord: The provider's record or None if not found
         """
-        for provider_info in PROVIDERS.get(model, []):
-            if provider_info["obj"] == provider_obj:
-                return provider_info
-        return None
+        return PROVIDERS.get(model, provider_obj)
 
-async def handle_chat(data: dict, key: str, stream: bool = False):
+async def handle_chat(data: dict, key: str, stream: bool = False, subscription_type: str | None = None):
     """
     Handle chat responses for both streaming and non-streaming requests.
     
@@ -182,6 +338,7 @@ async def handle_chat(data: dict, key: str, stream: bool = False):
         data: Request data containing model and messages, can be dict or Pydantic model
         key: API key or authentication token
         stream: Whether to stream the response
+        subscription_type: The user's tier, decides whether non-stream requests may be hedged
     
     Returns:
         Generated response from the chosen provider or error message if no provider is available
@@ -201,26 +358,29 @@ async def handle_chat(data: dict, key: str, stream: bool = False):
     if not chosen_provider:
         chosen_provider = await Utils.get_next_provider(model, require_stream=False)
     
+    tried = set()
+    # unhealthy providers are never picked (see health.py), the rest are checked against this request
     while chosen_provider:
-        if inspect.iscoroutinefunction(chosen_provider.check):
-            check_result = await chosen_provider.check(data)
-        else:
-            check_result = chosen_provider.check(data)
+        tried.add(chosen_provider)
+        if not await Utils.check_provider(chosen_provider, data):
+            await Utils.unpick(chosen_provider, model)
+            if DEBUG:
+                print(f"{chosen_provider.__class__.__name__} can't handle this request, trying another provider for model: {model}")
+            chosen_provider = await Utils.get_next_provider(model, require_stream=stream, exclude=tried)
+            continue
+
+        if DEBUG:
+            print(f"Using provider: {chosen_provider.__class__.__name__} for model: {model}")
 
-        if check_result:
+        try:
+            hedge_delay = None if stream else hedge_policy.delay(model, subscription_type)
+            if hedge_delay is not None:
+                return await Utils.hedged_generate(chosen_provider, model, data, key, hedge_delay)
+            return await Utils.generate(chosen_provider, model, data, stream, key)
+        except ProviderBusy:
             if DEBUG:
-                print(f"Using provider: {chosen_provider.__class__.__name__} for model: {model}")
-                            
-            return await chosen_provider.generate(
-                data,
-                stream,
-                key
-            )
-        else:
-            available_providers = [p["obj"] for p in PROVIDERS.get(model, [])]
-            if len(available_providers) > 1:
-                Utils.timeout_provider(chosen_provider)
-            chosen_provider = await Utils.get_next_provider(model, require_stream=stream)
+                print(f"{chosen_provider.__class__.__name__} is busy, trying another provider for model: {model}")
+        chosen_provider = await Utils.get_next_provider(model, require_stream=stream, exclude=tried)
 
     if DEBUG:
         print(f'No provider found for {model}')
@@ -0,0 +1,131 @@
+from collections import deque
+import asyncio
+import math
+import time
+import os
+
+from api.config import config
+
+QUEUE_SIZE: int = getattr(config, 'provider_queue_size', 10)  # requests that may wait for a busy provider
+QUEUE_TIMEOUT: float = getattr(config, 'provider_queue_timeout', 5.0)  # seconds before a waiting request tries another provider
+# worker processes sharing each provider's max_concurrency, uvicorn and gunicorn set WEB_CONCURRENCY
+WORKERS: int = getattr(config, 'workers', None) or int(os.environ.get('WEB_CONCURRENCY', 1))
+ALPHA = 0.2
+
+class ProviderBusy(Exception):
+    """Raised when a provider has no free slot within the queue timeout."""
+    def __init__(self, provider: str):
+        super().__init__(f"{provider} is at its concurrency limit")
+        self.provider = provider
+
+class ConcurrencyLimiter:
+    """Caps the in-flight requests of one provider, with a small FIFO wait queue.
+
+    A request gets a slot right away while fewer than `max_concurrency` are running,
+    otherwise it waits up to `timeout` seconds for one. When the queue is full the
+    provider is saturated and get_next_provider skips it.
+    """
+    def __init__(self, max_concurrency: int, queue_size: int = QUEUE_SIZE, timeout: float = QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self.rejected = 0
+        self.timeouts = 0
+        self.avg_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def saturated(self) -> bool:
+        return self.active >= self.max_concurrency and self.waiting >= self.queue_size
+
+    async def acquire(self) -> bool:
+        """Takes a slot, waiting in the queue if needed.
+
+        Returns:
+            bool: False if the queue is full or no slot freed up within the timeout.
+        """
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            return True
+        if self.waiting >= self.queue_size:
+            self.rejected += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just as the request went away, pass it on
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            waited = time.monotonic() - started
+            self.avg_wait += ALPHA * (waited - self.avg_wait)
+            self.max_wait = max(self.max_wait, waited)
+
+    def release(self) -> None:
+        """Frees a slot, handing it straight to the longest waiting request."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active = max(self.active - 1, 0)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "avg_wait": round(self.avg_wait, 3),
+            "max_wait": round(self.max_wait, 3)
+        }
+
+class ProviderLimits:
+    """Concurrency limiters of the providers that declare a `max_concurrency`.
+
+    Limiters live in each worker process. A provider's `max_concurrency` is its total
+    across the WORKERS workers, so each worker gets an equal share, rounded up and at
+    least 1. Set the `workers` config (or WEB_CONCURRENCY) to the number of workers.
+    """
+    def __init__(self):
+        self._limiters: dict[str, ConcurrencyLimiter] = {}
+
+    def get(self, provider) -> ConcurrencyLimiter | None:
+        name = provider.__class__.__name__
+        limiter = self._limiters.get(name)
+        if limiter is None:
+            max_concurrency = getattr(provider, 'max_concurrency', None)
+            if not max_concurrency:
+                return None
+            limiter = self._limiters[name] = ConcurrencyLimiter(
+                max(math.ceil(max_concurrency / WORKERS), 1),
+                getattr(provider, 'queue_size', None) or QUEUE_SIZE,
+                getattr(provider, 'queue_timeout', None) or QUEUE_TIMEOUT
+            )
+        return limiter
+
+    def saturated(self, provider) -> bool:
+        limiter = self.get(provider)
+        return limiter is not None and limiter.saturated()
+
+    def stats(self) -> dict[str, dict]:
+        return {name: limiter.stats() for name, limiter in self._limiters.items()}
+
+provider_limits = ProviderLimits()
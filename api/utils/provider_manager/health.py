@@ -0,0 +1,130 @@
+from dataclasses import dataclass, asdict
+import asyncio
+import inspect
+import time
+
+import ujson
+
+from api.utils.bad_models import reload_bad_models, set_auto_bad_models
+from api.utils.redis_manager import redis
+from api.config import config
+
+DEBUG = config.debug
+HEALTH_INTERVAL: int = getattr(config, 'provider_health_interval', 60)
+CANARY_INTERVAL: int = getattr(config, 'provider_canary_interval', 0)  # seconds between canary completions, 0 to only run check()
+CHECK_TIMEOUT: float = getattr(config, 'provider_health_timeout', 30)
+HEALTH_KEY = "provider_health"
+AUTO_BAD_KEY = "provider_health:bad_models"  # models this checker took down, on top of bad_models.json
+HEALTH_LOCK = "provider_health:lock"
+
+CANARY_MESSAGES = [{"role": "user", "content": "Reply with OK."}]
+
+@dataclass
+class HealthEntry:
+    healthy: bool
+    checked_at: float
+    latency: float = 0.0
+    error: str | None = None
+
+class HealthChecker:
+    """Runs the check() of the loaded chat providers and an optional canary completion in the background.
+
+    Only providers with `check_in_background = True` have their check() run here, their
+    check doesn't depend on the request; every other provider is checked against each
+    request by handle_chat and only gets the canary. Only the worker holding the lock runs
+    the checks in a given interval, on the providers that worker has loaded, so checking
+    never loads a provider. The results go to a Redis hash that every worker applies to
+    its ProviderRegistry. When every provider of a model is down, the model is added to
+    a Redis set every worker treats as part of bad_models, and taken off again once one
+    recovers. bad_models.json itself is only edited by hand.
+    """
+    def __init__(self, registry, canary):
+        self.registry = registry
+        self.canary = canary  # (provider, model, data) -> True if it answered, False if not, None if it was skipped
+        self.table: dict[str, HealthEntry] = {}  # {"provider|model": entry}
+        self._last_canary = 0.0
+
+    async def check(self, provider, model: str, canary: bool) -> HealthEntry | None:
+        """Checks one provider, None if there was nothing to check it with."""
+        background = getattr(provider, 'check_in_background', False)
+        if not background and not canary:
+            return None
+
+        data = {"model": model, "messages": CANARY_MESSAGES, "max_tokens": 5, "stream": False}
+        started = time.monotonic()
+        try:
+            if background:
+                result = provider.check(data)
+                if inspect.isawaitable(result):
+                    result = await asyncio.wait_for(result, CHECK_TIMEOUT)
+                if not result:
+                    return HealthEntry(False, time.time(), error="check() failed")
+
+            if canary and await asyncio.wait_for(self.canary(provider, model, data), CHECK_TIMEOUT) is False:
+                return HealthEntry(False, time.time(), time.monotonic() - started, "canary failed")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return HealthEntry(False, time.time(), time.monotonic() - started, str(e)[:200])
+        return HealthEntry(True, time.time(), time.monotonic() - started)
+
+    async def run_checks(self, canary: bool = False) -> None:
+        """Checks every loaded provider of every loaded model and publishes the results."""
+        results: dict[str, HealthEntry] = {}
+        for model, providers in self.registry.loaded().items():
+            if not providers:
+                continue
+            entries = await asyncio.gather(*(self.check(provider, model, canary) for provider in providers))
+            checked = [entry for entry in entries if entry is not None]
+            if not checked:
+                continue
+            for provider, entry in zip(providers, entries):
+                if entry is not None:
+                    results[f"{provider.__class__.__name__}|{model}"] = entry
+
+            # a model is only down if every one of its providers was checked and failed
+            if any(entry.healthy for entry in checked):
+                await self.update_bad_models(model, True)
+            elif len(checked) == len(providers):
+                await self.update_bad_models(model, False)
+
+        if results:
+            await redis.hset(HEALTH_KEY, mapping={field: ujson.dumps(asdict(entry)) for field, entry in results.items()})
+            # stale results go away if no worker checks anymore
+            await redis.expire(HEALTH_KEY, HEALTH_INTERVAL * 5)
+
+    async def update_bad_models(self, model: str, up: bool) -> None:
+        if not up:
+            if await redis.sadd(AUTO_BAD_KEY, model.lower()) and DEBUG:
+                print(f"Every provider of {model} is down, marked it as a bad model")
+        elif await redis.srem(AUTO_BAD_KEY, model.lower()) and DEBUG:
+            print(f"{model} recovered, no longer a bad model")
+
+    async def refresh(self) -> None:
+        """Applies the published health table to this worker's registry and bad model list."""
+        reload_bad_models()
+        set_auto_bad_models(await redis.smembers(AUTO_BAD_KEY))
+        saved = await redis.hgetall(HEALTH_KEY)
+        for field, value in saved.items():
+            entry = HealthEntry(**ujson.loads(value))
+            self.table[field] = entry
+            provider, _, model = field.partition("|")
+            self.registry.set_healthy(model, provider, entry.healthy)
+
+    def stats(self) -> dict[str, dict]:
+        return {field: asdict(entry) for field, entry in self.table.items()}
+
+    async def run(self, interval: int = HEALTH_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if await redis.set(HEALTH_LOCK, "1", nx=True, ex=max(interval - 1, 1)):
+                    canary = bool(CANARY_INTERVAL) and time.monotonic() - self._last_canary >= CANARY_INTERVAL
+                    if canary:
+                        self._last_canary = time.monotonic()
+                    await self.run_checks(canary)
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error checking provider health: {e}")
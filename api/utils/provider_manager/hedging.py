@@ -0,0 +1,94 @@
+from api.utils.provider_stats import provider_stats
+from api.config import config
+
+# hedging:
+#   enabled: true
+#   percentile: 0.9        # hedge once the first provider is slower than this share of recent calls
+#   budget: 0.1            # at most this many extra upstream calls per hedgeable request
+#   min_delay: 0.5         # seconds, never hedge sooner than this
+#   tiers: [premium, custom]  # leave out to hedge every tier
+#   models:                # per model overrides, `false` turns hedging off for a model
+#     gpt-4o: {percentile: 0.95}
+HEDGING: dict = getattr(config, 'hedging', None) or {}
+BUDGET_BURST: float = HEDGING.get('burst', 10.0)  # hedges that can be saved up while traffic is fast
+
+class HedgePolicy:
+    """Decides when a non-stream chat request gets a second provider, and keeps the hedge budget.
+
+    Every hedgeable request earns `budget` tokens and every hedge spends one, so hedges stay
+    within that share of upstream calls. Requests on a model without latency samples can't
+    be hedged and earn nothing, so a cold start doesn't fill the bucket. Win rates are kept to see whether hedging pays off.
+    """
+    def __init__(self, settings: dict = HEDGING):
+        self.enabled = settings.get('enabled', False)
+        self.percentile = settings.get('percentile', 0.9)
+        self.budget = settings.get('budget', 0.1)
+        self.min_delay = settings.get('min_delay', 0.5)
+        self.tiers = settings.get('tiers')
+        self.models = settings.get('models', {})
+        self.tokens = 0.0
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+        self.denied = 0  # requests that were slow enough to hedge but the budget was spent
+
+    def delay(self, model: str, subscription_type: str | None = None) -> float | None:
+        """Seconds to wait for the first provider before hedging, None if this request can't be hedged.
+
+        Args:
+            model: The model identifier.
+            subscription_type: The user's tier, checked against the configured tiers.
+
+        Returns:
+            float | None: The hedge delay, or None when hedging is off or there is no latency data yet.
+        """
+        if not self.enabled:
+            return None
+        if self.tiers is not None and subscription_type not in self.tiers:
+            return None
+
+        overrides = self.models.get(model, {})
+        if overrides is False:
+            return None
+        if overrides is True:
+            overrides = {}
+
+        latency = provider_stats.latency_percentile(model, overrides.get('percentile', self.percentile))
+        if latency is None:
+            return None
+
+        self.requests += 1
+        self.tokens = min(self.tokens + overrides.get('budget', self.budget), BUDGET_BURST)
+        return max(latency, overrides.get('min_delay', self.min_delay))
+
+    def can_hedge(self) -> bool:
+        """Whether the budget has a hedge left."""
+        if self.tokens < 1:
+            self.denied += 1
+            return False
+        return True
+
+    def spend(self) -> None:
+        self.tokens -= 1
+        self.hedged += 1
+
+    def record_winner(self, hedge: bool) -> None:
+        if hedge:
+            self.hedge_wins += 1
+        else:
+            self.primary_wins += 1
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "denied": self.denied,
+            "hedge_rate": round(self.hedged / self.requests, 4) if self.requests else 0,
+            "hedge_wins": self.hedge_wins,
+            "primary_wins": self.primary_wins,
+            "hedge_win_rate": round(self.hedge_wins / self.hedged, 4) if self.hedged else 0
+        }
+
+hedge_policy = HedgePolicy()
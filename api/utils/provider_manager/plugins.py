@@ -0,0 +1,343 @@
+from contextlib import contextmanager
+from typing import Callable
+import importlib
+import inspect
+import asyncio
+import time
+import sys
+import os
+
+import ujson
+
+from api.baseproviders import EmbeddingsBaseProvider, ModerationBaseProvider, ImagesBaseProvider
+from api.utils.redis_manager import redis
+from api.config import config
+
+base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, base_dir)
+
+MANIFEST_PATH: str = getattr(config, 'provider_manifest', 'data/provider_manifest.json')
+MANIFEST_VERSION = 1
+RELOAD_INTERVAL: int = getattr(config, 'provider_reload_interval', 0)  # seconds between checks for changed providers, 0 to only reload from the admin route
+DRAIN_TIMEOUT: int = getattr(config, 'provider_drain_timeout', 300)  # seconds replaced providers get to finish their requests
+RELOAD_CHANNEL = "providers:reload"
+
+def _is_chat_provider(obj) -> bool:
+    return hasattr(obj, 'models') and hasattr(obj, 'generate') and hasattr(obj, 'check')
+
+def _subclass_of(base):
+    return lambda obj: issubclass(obj, base) and obj is not base
+
+# kind: (directory under providers/, class filter, whether providers with working = False are skipped)
+KINDS = {
+    "chat": ("chat", _is_chat_provider, True),
+    "images": ("images", _subclass_of(ImagesBaseProvider), False),
+    "embeddings": ("embeddings", _subclass_of(EmbeddingsBaseProvider), False),
+    "moderation": ("moderation", _subclass_of(ModerationBaseProvider), False),
+    "tts": ("tts", _subclass_of(ModerationBaseProvider), False),
+}
+
+class PluginRegistry:
+    """Finds providers through a cached manifest and imports them on first use.
+
+    The manifest maps every provider module to the classes it defines and the models they
+    serve. It is saved to MANIFEST_PATH and only the modules whose file changed since are
+    imported again to rebuild it, so a worker starts without importing any provider.
+    Without a saved manifest (first deploy, or a changed `provider_manifest` path) every
+    provider module is still imported once on startup to build it: requests can't be
+    routed before the manifest says which provider serves which model.
+    Providers are created the first time one of their models is requested, or at startup
+    for the models listed in the `provider_warmup` config.
+
+    `reload` re-imports changed provider modules and swaps them in at once. Replaced
+    instances get no new requests and are closed once their in-flight requests finish.
+    `reload_all` does the same and tells every other worker to reload over Redis pub/sub.
+    """
+    def __init__(self, manifest_path: str = MANIFEST_PATH):
+        self.manifest_path = manifest_path
+        self._manifest: dict | None = None
+        self._index: dict[str, dict[str, list[str]]] = {}  # {kind: {model: [class paths]}}
+        self._instances: dict[str, object] = {}  # {class path: provider}
+        self._loaded: dict[tuple[str, str], list] = {}  # {(kind, model): [providers]}
+        self._in_flight: dict[int, int] = {}  # {id(provider): requests}
+        self.listeners: list[Callable[[], None]] = []  # called after a reload swapped providers
+
+    def ensure_manifest(self) -> dict:
+        if self._manifest is None:
+            self._manifest = self.build_manifest()
+            self._index = self._build_index(self._manifest)
+        return self._manifest
+
+    def _scan(self) -> dict[str, tuple[str, int]]:
+        """Every provider file on disk, as {relative path: (kind, mtime in ns)}."""
+        files = {}
+        for kind, (directory, _, _) in KINDS.items():
+            for root, _, names in os.walk(os.path.join(base_dir, 'providers', directory)):
+                for name in names:
+                    if not name.endswith('.py') or name == '__init__.py':
+                        continue
+                    path = os.path.join(root, name)
+                    relative = os.path.relpath(path, base_dir)
+                    if "deprecated" in relative:
+                        continue
+                    files[relative] = (kind, os.stat(path).st_mtime_ns)
+        return files
+
+    @staticmethod
+    def _module_name(relative: str) -> str:
+        return relative[:-3].replace(os.sep, '.')
+
+    def _inspect(self, relative: str, kind: str, instances: dict | None = None) -> list[dict]:
+        """Imports one provider module and lists the provider classes in it."""
+        module_name = self._module_name(relative)
+        _, is_provider, check_working = KINDS[kind]
+        instances = self._instances if instances is None else instances
+        classes = []
+
+        try:
+            module = importlib.import_module(module_name)
+            for name, obj in inspect.getmembers(module):
+                if not inspect.isclass(obj) or not is_provider(obj):
+                    continue
+                path = f"{obj.__module__}:{obj.__qualname__}"
+                provider = instances.get(path) or obj()
+                if check_working and getattr(provider, 'working', True) is False:
+                    continue
+                instances[path] = provider
+                classes.append({"path": path, "models": list(getattr(provider, 'models', []) or [])})
+        except Exception as e:
+            print(f"Error loading {module_name}: {e}")
+        return classes
+
+    def build_manifest(self) -> dict:
+        """Loads the saved manifest and re-inspects the files that were added or changed."""
+        try:
+            with open(self.manifest_path, 'r') as f:
+                saved = ujson.load(f)
+            if saved.get("version") != MANIFEST_VERSION:
+                saved = {}
+        except (OSError, ValueError):
+            saved = {}
+        if not saved:
+            print(f"No provider manifest at {self.manifest_path}, importing every provider to build it")
+
+        cached = saved.get("files", {})
+        files = {}
+        changed = False
+        for relative, (kind, mtime) in self._scan().items():
+            entry = cached.get(relative)
+            if entry is None or entry["mtime"] != mtime or entry["kind"] != kind:
+                entry = {"kind": kind, "mtime": mtime, "classes": self._inspect(relative, kind)}
+                changed = True
+            files[relative] = entry
+
+        manifest = {"version": MANIFEST_VERSION, "files": files}
+        if changed or len(files) != len(cached):
+            self._save(manifest)
+        return manifest
+
+    def _save(self, manifest: dict) -> None:
+        # written to a temporary file first, so other workers never read half a manifest
+        try:
+            os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+            temporary = f"{self.manifest_path}.{os.getpid()}.tmp"
+            with open(temporary, 'w') as f:
+                ujson.dump(manifest, f, indent=4)
+            os.replace(temporary, self.manifest_path)
+        except OSError as e:
+            print(f"Error saving provider manifest: {e}")
+
+    @staticmethod
+    def _build_index(manifest: dict) -> dict[str, dict[str, list[str]]]:
+        index = {kind: {} for kind in KINDS}
+        for entry in manifest["files"].values():
+            models = index[entry["kind"]]
+            for provider in entry["classes"]:
+                for model in provider["models"]:
+                    paths = models.setdefault(model, [])
+                    if provider["path"] not in paths:
+                        paths.append(provider["path"])
+        return index
+
+    def _instance(self, path: str):
+        provider = self._instances.get(path)
+        if provider is None:
+            module_name, _, qualname = path.partition(':')
+            obj = importlib.import_module(module_name)
+            for part in qualname.split('.'):
+                obj = getattr(obj, part)
+            provider = self._instances[path] = obj()
+        return provider
+
+    def load(self, kind: str, model: str) -> list:
+        """The providers of a model, importing and creating them the first time.
+
+        Args:
+            kind: One of KINDS, e.g. "chat" or "images".
+            model: The model identifier.
+
+        Returns:
+            list: The provider instances, empty if no provider serves the model.
+        """
+        providers = self._loaded.get((kind, model))
+        if providers is not None:
+            return providers
+
+        self.ensure_manifest()
+        providers = []
+        for path in self._index[kind].get(model, []):
+            try:
+                providers.append(self._instance(path))
+            except Exception as e:
+                print(f"Error loading provider {path}: {e}")
+        self._loaded[(kind, model)] = providers
+        return providers
+
+    def models(self, kind: str) -> list[str]:
+        self.ensure_manifest()
+        return list(self._index[kind])
+
+    def provider_count(self, kind: str) -> int:
+        self.ensure_manifest()
+        return len({path for paths in self._index[kind].values() for path in paths})
+
+    def warm_up(self, models: dict[str, list[str]] | None = None) -> None:
+        """Loads the providers of frequently used models ahead of their first request.
+
+        Args:
+            models: {kind: [model, ...]}, defaults to the `provider_warmup` config.
+        """
+        if models is None:
+            models = getattr(config, 'provider_warmup', None) or {}
+        for kind, names in models.items():
+            for model in names:
+                self.load(kind, model)
+
+    @contextmanager
+    def using(self, provider):
+        """Counts a request as in flight on a provider, so a reload waits for it."""
+        self.acquire(provider)
+        try:
+            yield provider
+        finally:
+            self.release(provider)
+
+    def acquire(self, provider) -> None:
+        self._in_flight[id(provider)] = self._in_flight.get(id(provider), 0) + 1
+
+    def release(self, provider) -> None:
+        remaining = self._in_flight.get(id(provider), 1) - 1
+        if remaining > 0:
+            self._in_flight[id(provider)] = remaining
+        else:
+            self._in_flight.pop(id(provider), None)
+
+    def reload(self) -> dict[str, list[str]]:
+        """Re-imports the provider modules that changed on disk and swaps them in.
+
+        The new manifest, index and instances are built first and replace the old ones in
+        one step, so requests never see a half reloaded registry.
+
+        Returns:
+            dict[str, list[str]]: The changed and removed provider files.
+        """
+        old_files = self.ensure_manifest()["files"]
+        files = self._scan()
+        changed = [relative for relative, (kind, mtime) in files.items() if relative not in old_files or old_files[relative]["mtime"] != mtime]
+        removed = [relative for relative in old_files if relative not in files]
+        if not changed and not removed:
+            return {"changed": [], "removed": []}
+
+        affected = {self._module_name(relative) for relative in changed + removed}
+        retired = [provider for path, provider in self._instances.items() if path.partition(':')[0] in affected]
+        instances = {path: provider for path, provider in self._instances.items() if path.partition(':')[0] not in affected}
+
+        new_files = {relative: entry for relative, entry in old_files.items() if relative in files}
+        for relative in changed:
+            kind, mtime = files[relative]
+            module_name = self._module_name(relative)
+            if module_name in sys.modules:
+                try:
+                    importlib.reload(sys.modules[module_name])
+                except Exception as e:
+                    print(f"Error reloading {module_name}: {e}")
+            new_files[relative] = {"kind": kind, "mtime": mtime, "classes": self._inspect(relative, kind, instances)}
+
+        manifest = {"version": MANIFEST_VERSION, "files": new_files}
+        self._manifest, self._index, self._instances, self._loaded = manifest, self._build_index(manifest), instances, {}
+        self._save(manifest)
+        for listener in self.listeners:
+            listener()
+
+        for provider in retired:
+            self._retire(provider)
+        return {"changed": changed, "removed": removed}
+
+    async def reload_all(self) -> dict[str, list[str]]:
+        """Reloads this worker's providers and broadcasts the reload to the other workers."""
+        result = self.reload()
+        try:
+            await redis.publish(RELOAD_CHANNEL, "reload")
+        except Exception as e:
+            print(f"Error publishing provider reload: {e}")
+        return result
+
+    async def listen(self) -> None:
+        """Reloads when another worker broadcasts a reload, reconnecting if Redis drops."""
+        while True:
+            pubsub = redis.pubsub()
+            try:
+                await pubsub.subscribe(RELOAD_CHANNEL)
+                # a reload broadcast while we were disconnected was missed
+                self.reload()
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        result = self.reload()
+                        if result["changed"] or result["removed"]:
+                            print(f"Reloaded providers: {result}")
+            except asyncio.CancelledError:
+                await pubsub.reset()
+                raise
+            except Exception as e:
+                print(f"Provider reload listener error: {e}")
+                await pubsub.reset()
+                await asyncio.sleep(1)
+
+    def _retire(self, provider) -> None:
+        try:
+            asyncio.get_running_loop().create_task(self._drain(provider))
+        except RuntimeError:
+            pass
+
+    async def _drain(self, provider) -> None:
+        """Closes a replaced provider once its in-flight requests are done."""
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        # give requests that picked the provider just before the swap time to start
+        await asyncio.sleep(1)
+        while self._in_flight.get(id(provider)) and time.monotonic() < deadline:
+            await asyncio.sleep(1)
+
+        close = getattr(provider, 'aclose', None) or getattr(provider, 'close', None)
+        if close is None:
+            return
+        try:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            print(f"Error closing provider {provider.__class__.__name__}: {e}")
+
+    async def watch(self) -> None:
+        """Reloads changed providers every RELOAD_INTERVAL seconds, when it is set."""
+        if not RELOAD_INTERVAL:
+            return
+        while True:
+            await asyncio.sleep(RELOAD_INTERVAL)
+            try:
+                result = self.reload()
+                if result["changed"] or result["removed"]:
+                    print(f"Reloaded providers: {result}")
+            except Exception as e:
+                print(f"Error reloading providers: {e}")
+
+plugins = PluginRegistry()
@@ -0,0 +1,157 @@
+from dataclasses import dataclass
+from datetime import date
+import asyncio
+import time
+
+from api.database import ProviderManager
+from api.utils.redis_manager import redis
+from api.config import config
+
+LEASE_SIZE: int = getattr(config, 'provider_lease_size', 10)
+LEASE_TTL: int = getattr(config, 'provider_lease_ttl', 60)  # seconds before unused quota goes back
+EXHAUSTED_RETRY: int = getattr(config, 'provider_lease_retry', 30)  # seconds before asking again once the limit is reached
+QUOTA_KEY_TTL = 2 * 24 * 60 * 60
+
+# KEYS[1] = calls reserved today, ARGV = block, limit, key ttl, seed
+# the seed is today's usage from mongo, only used by the first lease of the day
+LEASE_SCRIPT = """
+redis.call('SET', KEYS[1], ARGV[4], 'NX', 'EX', ARGV[3])
+local current = tonumber(redis.call('GET', KEYS[1]))
+local granted = math.min(tonumber(ARGV[1]), tonumber(ARGV[2]) - current)
+if granted <= 0 then
+    return 0
+end
+redis.call('INCRBY', KEYS[1], granted)
+return granted
+"""
+lease_script = redis.register_script(LEASE_SCRIPT)
+
+# KEYS[1] = calls reserved, ARGV[1] = unused calls to give back
+RELEASE_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local returned = math.min(tonumber(ARGV[1]), current)
+if returned > 0 then
+    redis.call('DECRBY', KEYS[1], returned)
+end
+return returned
+"""
+release_script = redis.register_script(RELEASE_SCRIPT)
+
+def quota_key(provider: str, day: str) -> str:
+    return f"provider_quota:{day}:{provider}"
+
+@dataclass
+class Lease:
+    day: str
+    remaining: int
+    expires: float
+
+class QuotaLeases:
+    """Spends the daily limit of limited providers from blocks reserved in Redis.
+
+    Each worker reserves up to LEASE_SIZE calls at a time from a shared per-day counter
+    and hands them out locally, so the common case needs no I/O. Unused calls go back to
+    the counter when a lease expires and on shutdown, so no worker sits on quota that
+    another one could use. Reserved calls never exceed the limit, across every worker.
+    """
+    def __init__(self, lease_size: int = LEASE_SIZE, ttl: int = LEASE_TTL):
+        self.lease_size = lease_size
+        self.ttl = ttl
+        self._leases: dict[str, Lease] = {}
+        self._exhausted: dict[str, tuple[str, float]] = {}  # {provider: (day, retry at)}
+        self._seeded: set[tuple[str, str]] = set()
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    def try_acquire(self, provider: str) -> bool:
+        """Spends one call from the local lease, without any I/O."""
+        lease = self._leases.get(provider)
+        if lease and lease.remaining > 0 and lease.day == date.today().isoformat() and time.monotonic() < lease.expires:
+            lease.remaining -= 1
+            return True
+        return False
+
+    async def acquire(self, provider: str, limit: int) -> bool:
+        """Spends one call of a provider's daily limit, reserving a new block if the lease ran out.
+
+        Args:
+            provider: The provider's name.
+            limit: The provider's daily request limit.
+
+        Returns:
+            bool: True if the call fits in today's limit.
+        """
+        if self.try_acquire(provider):
+            return True
+
+        today = date.today().isoformat()
+        exhausted = self._exhausted.get(provider)
+        if exhausted and exhausted[0] == today and time.monotonic() < exhausted[1]:
+            return False
+
+        async with self._locks.setdefault(provider, asyncio.Lock()):
+            # another request may have refilled while we waited
+            if self.try_acquire(provider):
+                return True
+
+            await self.release(provider)
+            try:
+                granted = await self._reserve(provider, limit, today)
+            except Exception as e:
+                print(f"Error reserving provider quota: {e}")
+                return False
+
+            if granted <= 0:
+                self._exhausted[provider] = (today, time.monotonic() + EXHAUSTED_RETRY)
+                return False
+
+            self._exhausted.pop(provider, None)
+            self._leases[provider] = Lease(day=today, remaining=granted - 1, expires=time.monotonic() + self.ttl)
+            return True
+
+    async def _reserve(self, provider: str, limit: int, today: str) -> int:
+        # small limits are split finer, so one worker can't hold all of it
+        block = max(1, min(self.lease_size, limit // 10))
+
+        seed = 0
+        if (provider, today) not in self._seeded:
+            seed = await ProviderManager.get_provider_usage_today(provider) or 0
+            self._seeded.add((provider, today))
+
+        return int(await lease_script(keys=[quota_key(provider, today)], args=[block, limit, QUOTA_KEY_TTL, seed]))
+
+    async def refund(self, provider: str) -> None:
+        """Gives back one call that was spent but never sent, to the lease if it is still held."""
+        lease = self._leases.get(provider)
+        today = date.today().isoformat()
+        if lease is not None and lease.day == today:
+            lease.remaining += 1
+            return
+        try:
+            await release_script(keys=[quota_key(provider, today)], args=[1])
+        except Exception as e:
+            print(f"Error refunding provider quota: {e}")
+
+    async def release(self, provider: str) -> None:
+        """Gives a provider's unused calls back to the shared counter."""
+        lease = self._leases.pop(provider, None)
+        if lease is None or lease.remaining <= 0:
+            return
+        try:
+            await release_script(keys=[quota_key(provider, lease.day)], args=[lease.remaining])
+        except Exception as e:
+            print(f"Error releasing provider quota: {e}")
+
+    async def release_all(self) -> None:
+        for provider in list(self._leases):
+            await self.release(provider)
+
+    async def run(self) -> None:
+        """Returns the quota of expired leases, so idle workers don't hold on to it."""
+        while True:
+            await asyncio.sleep(max(self.ttl // 4, 1))
+            now = time.monotonic()
+            for provider, lease in list(self._leases.items()):
+                if now >= lease.expires:
+                    await self.release(provider)
+
+quota_leases = QuotaLeases()
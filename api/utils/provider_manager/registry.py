@@ -0,0 +1,152 @@
+from typing import Callable
+import time
+
+from api.utils.circuit_breaker import circuit_breakers
+
+class ProviderRecord:
+    """One provider serving one model."""
+    __slots__ = ("obj", "name", "stream", "limit", "bit")
+
+    def __init__(self, obj, bit: int):
+        self.obj = obj  # the provider instance
+        self.name: str = obj.__class__.__name__
+        self.stream: bool = getattr(obj, 'stream', False)  # whether or not the provider can stream
+        self.limit: int | None = getattr(obj, 'limit', None)  # daily limit of requests that can be sent
+        self.bit = bit  # this record's bit in the model's masks
+
+class ModelProviders:
+    """The providers of one model, with bitmasks of the streaming, available and healthy ones."""
+    __slots__ = ("records", "by_obj", "stream_mask", "available_mask", "healthy_mask", "retry_at")
+
+    def __init__(self):
+        self.records: list[ProviderRecord] = []
+        self.by_obj: dict[object, ProviderRecord] = {}
+        self.stream_mask = 0
+        self.available_mask = 0
+        self.healthy_mask = 0  # cleared by the background health checker
+        self.retry_at = float("inf")  # earliest time a provider whose breaker is open may be back
+
+class ProviderRegistry:
+    """Chat providers indexed by model, with O(1) lookups and availability bitmasks.
+
+    Bit `i` of a model's masks stands for its `i`th record. Circuit breakers clear a
+    provider's bit when they open, and the bit is set again once the breaker's backoff
+    has passed, so picking candidates is a couple of integer ANDs.
+
+    With a `loader`, a model's providers are loaded the first time the model is looked up.
+    """
+    def __init__(self, loader: Callable[[str], list] | None = None):
+        self._models: dict[str, ModelProviders] = {}
+        self._loader = loader
+        self._loaded: set[str] = set()
+        circuit_breakers.listeners.append(self.on_breaker_change)
+
+    def reset(self) -> None:
+        """Forgets every loaded model, they are loaded again from the loader on their next lookup."""
+        self._models, self._loaded = {}, set()
+
+    def _entry(self, model: str) -> ModelProviders | None:
+        if self._loader is not None and model not in self._loaded:
+            self._loaded.add(model)
+            for obj in self._loader(model):
+                self.add(model, obj)
+        return self._models.get(model)
+
+    def add(self, model: str, obj) -> ProviderRecord:
+        entry = self._models.get(model)
+        if entry is None:
+            entry = self._models[model] = ModelProviders()
+
+        record = entry.by_obj.get(obj)
+        if record is not None:
+            return record
+
+        record = ProviderRecord(obj, 1 << len(entry.records))
+        entry.records.append(record)
+        entry.by_obj[obj] = record
+        # breakers outlive the records, e.g. when a reload rebuilds them while one is open
+        if circuit_breakers.available(record.name, model):
+            entry.available_mask |= record.bit
+        else:
+            entry.retry_at = min(entry.retry_at, circuit_breakers.get(record.name, model).open_until)
+        entry.healthy_mask |= record.bit
+        if record.stream:
+            entry.stream_mask |= record.bit
+        return record
+
+    def loaded(self) -> dict[str, list]:
+        """The provider instances of every model looked up so far, without loading any other."""
+        return {model: [record.obj for record in entry.records] for model, entry in self._models.items()}
+
+    def get(self, model: str, obj) -> ProviderRecord | None:
+        entry = self._entry(model)
+        return entry.by_obj.get(obj) if entry else None
+
+    def count(self, model: str) -> int:
+        entry = self._entry(model)
+        return len(entry.records) if entry else 0
+
+    def candidates(self, model: str, require_stream: bool = False, exclude: set | None = None) -> list[ProviderRecord]:
+        """Records of the providers that can take a request for a model right now.
+
+        Args:
+            model: The model identifier
+            require_stream: Whether streaming capability is required
+            exclude: Provider instances that must not be returned
+
+        Returns:
+            list[ProviderRecord]: The available records, in registration order
+        """
+        entry = self._entry(model)
+        if entry is None:
+            return []
+
+        if time.monotonic() >= entry.retry_at:
+            self._refresh(model, entry)
+
+        mask = entry.available_mask & entry.healthy_mask
+        if require_stream:
+            mask &= entry.stream_mask
+        if exclude:
+            for obj in exclude:
+                record = entry.by_obj.get(obj)
+                if record is not None:
+                    mask &= ~record.bit
+        return [record for record in entry.records if mask & record.bit]
+
+    def _refresh(self, model: str, entry: ModelProviders) -> None:
+        """Sets the bits of providers whose breaker backoff has passed."""
+        entry.retry_at = float("inf")
+        for record in entry.records:
+            if entry.available_mask & record.bit:
+                continue
+            if circuit_breakers.available(record.name, model):
+                entry.available_mask |= record.bit
+            else:
+                entry.retry_at = min(entry.retry_at, circuit_breakers.get(record.name, model).open_until)
+
+    def set_healthy(self, model: str, provider: str, healthy: bool) -> None:
+        """Marks a provider healthy or not for a model, models that aren't loaded yet are skipped."""
+        entry = self._models.get(model)
+        if entry is None:
+            return
+        for record in entry.records:
+            if record.name != provider:
+                continue
+            if healthy:
+                entry.healthy_mask |= record.bit
+            else:
+                entry.healthy_mask &= ~record.bit
+
+    def on_breaker_change(self, provider: str, model: str, available: bool, retry_at: float) -> None:
+        entry = self._models.get(model)
+        if entry is None:
+            return
+        for record in entry.records:
+            if record.name != provider:
+                continue
+            if available:
+                entry.available_mask |= record.bit
+            else:
+                entry.available_mask &= ~record.bit
+                entry.retry_at = min(entry.retry_at, retry_at)
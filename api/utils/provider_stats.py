@@ -0,0 +1,187 @@
+from contextvars import ContextVar
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Awaitable, Callable
+import asyncio
+import random
+import time
+
+import ujson
+
+from api.utils.circuit_breaker import circuit_breakers
+from api.utils.redis_manager import redis
+from api.config import config
+
+ALPHA: float = getattr(config, 'provider_stats_alpha', 0.2)  # weight of the newest sample in the EWMAs
+DEFAULT_LATENCY: float = getattr(config, 'provider_default_latency', 2.0)  # seconds, assumed until a provider has samples
+ERROR_PENALTY: float = getattr(config, 'provider_error_penalty', 10.0)
+PERSIST_INTERVAL: int = getattr(config, 'provider_stats_interval', 30)
+LATENCY_SAMPLES: int = getattr(config, 'provider_latency_samples', 200)  # recent non-stream latencies kept per model
+MIN_LATENCY_SAMPLES: int = getattr(config, 'provider_min_latency_samples', 20)
+STATS_KEY = "provider_stats"
+
+@dataclass
+class ProviderStats:
+    """Exponentially weighted stats of one provider serving one model."""
+    latency: float = 0.0  # seconds until the whole response
+    ttft: float = 0.0  # seconds until the first streamed token
+    error_rate: float = 0.0
+    samples: int = 0
+    in_flight: int = 0
+
+    def score(self, stream: bool) -> float:
+        """Expected cost of sending one more request, lower is better."""
+        latency = (self.ttft if stream and self.ttft else self.latency) or DEFAULT_LATENCY
+        return latency * (1 + self.in_flight) * (1 + ERROR_PENALTY * self.error_rate)
+
+def _ewma(current: float, sample: float, first: bool) -> float:
+    return sample if first else current + ALPHA * (sample - current)
+
+class ProviderCall:
+    """Measures one provider call, finished by handle_chat or, for streams, by the stream wrapper."""
+    def __init__(self, registry: "ProviderStatsRegistry", provider: str, model: str):
+        self.registry = registry
+        self.provider = provider
+        self.model = model
+        self.started = time.monotonic()
+        self.ttft: float | None = None
+        self.streaming = False
+        self.finished = False
+        self.on_finish: list[Callable[[], None]] = []  # e.g. frees the provider's concurrency slot
+        self.failover: Callable[[str], Awaitable[tuple] | None] | None = None  # resumes a broken stream on another provider, see Utils.failover_stream
+        registry.get(provider, model).in_flight += 1
+
+    def first_token(self) -> None:
+        if self.ttft is None:
+            self.ttft = time.monotonic() - self.started
+
+    def finish(self, error: bool = False, retry_after: float | None = None) -> None:
+        if self.finished:
+            return
+        self.finished = True
+        latency = time.monotonic() - self.started
+        self.registry.record(self.provider, self.model, latency, self.ttft, error)
+        if not error and not self.streaming:
+            self.registry.observe_latency(self.model, latency)
+        # a long stream is not a slow provider, the breaker judges streams by their first token
+        breaker_latency = self.ttft if self.streaming and self.ttft is not None else latency
+        circuit_breakers.record(self.provider, self.model, error, breaker_latency, retry_after)
+        for callback in self.on_finish:
+            callback()
+
+    def cancel(self) -> None:
+        """Ends a call that was cancelled on purpose (e.g. a lost hedge), without recording an outcome."""
+        if self.finished:
+            return
+        self.finished = True
+        stats = self.registry.get(self.provider, self.model)
+        stats.in_flight = max(stats.in_flight - 1, 0)
+        circuit_breakers.release(self.provider, self.model)
+        for callback in self.on_finish:
+            callback()
+
+    def __del__(self):
+        # a stream that was never read never reaches its wrapper's finally
+        if not self.finished:
+            self.cancel()
+
+# the call being made by handle_chat, picked up by stream wrappers created inside `generate`
+current_call: ContextVar[ProviderCall | None] = ContextVar("current_call", default=None)
+# set while a broken stream fails over, the stream wrapper then hands over the raw stream instead of wrapping it
+stream_capture: ContextVar[list | None] = ContextVar("stream_capture", default=None)
+
+class ProviderStatsRegistry:
+    """Latency, TTFT, error rate and in-flight count per (provider, model).
+
+    Used to pick providers with power-of-two-choices: two random candidates are compared
+    and the one with the lower score wins, which keeps load spread while steering away from
+    slow or failing providers. Stats are saved to a Redis hash so new workers start warm.
+    """
+    def __init__(self):
+        self._stats: dict[tuple[str, str], ProviderStats] = {}
+        self._latencies: dict[str, deque[float]] = {}
+
+    def get(self, provider: str, model: str) -> ProviderStats:
+        stats = self._stats.get((provider, model))
+        if stats is None:
+            stats = self._stats[(provider, model)] = ProviderStats()
+        return stats
+
+    def start(self, provider: str, model: str) -> ProviderCall:
+        return ProviderCall(self, provider, model)
+
+    def record(self, provider: str, model: str, latency: float, ttft: float | None, error: bool) -> None:
+        stats = self.get(provider, model)
+        first = stats.samples == 0
+
+        stats.in_flight = max(stats.in_flight - 1, 0)
+        stats.error_rate = _ewma(stats.error_rate, 1.0 if error else 0.0, first)
+        if not error:
+            stats.latency = _ewma(stats.latency, latency, first or not stats.latency)
+            if ttft is not None:
+                stats.ttft = _ewma(stats.ttft, ttft, first or not stats.ttft)
+        stats.samples += 1
+
+    def observe_latency(self, model: str, latency: float) -> None:
+        samples = self._latencies.get(model)
+        if samples is None:
+            samples = self._latencies[model] = deque(maxlen=LATENCY_SAMPLES)
+        samples.append(latency)
+
+    def latency_percentile(self, model: str, percentile: float) -> float | None:
+        """Latency of successful non-stream calls for a model at `percentile` (0-1), None until there are enough samples."""
+        samples = self._latencies.get(model)
+        if not samples or len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(int(percentile * len(ordered)), len(ordered) - 1)]
+
+    def choose(self, candidates: list, model: str, stream: bool = False):
+        """Picks one of `candidates` (ProviderRecords) with power-of-two-choices."""
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.sample(candidates, 2)
+        first_score = self.get(first.name, model).score(stream)
+        second_score = self.get(second.name, model).score(stream)
+        return first if first_score <= second_score else second
+
+    def snapshot(self) -> dict[str, dict]:
+        return {f"{provider}|{model}": asdict(stats) for (provider, model), stats in self._stats.items()}
+
+    async def load(self) -> None:
+        """Starts from the stats other workers saved, for providers this worker hasn't used yet."""
+        try:
+            saved = await redis.hgetall(STATS_KEY)
+        except Exception as e:
+            print(f"Error loading provider stats: {e}")
+            return
+
+        for field, value in saved.items():
+            provider, _, model = field.partition("|")
+            stats = self.get(provider, model)
+            if stats.samples:
+                continue
+            data = ujson.loads(value)
+            stats.latency = data.get("latency", 0.0)
+            stats.ttft = data.get("ttft", 0.0)
+            stats.error_rate = data.get("error_rate", 0.0)
+            stats.samples = data.get("samples", 0)
+
+    async def save(self) -> None:
+        fields = {
+            field: ujson.dumps({k: v for k, v in stats.items() if k != "in_flight"})
+            for field, stats in self.snapshot().items() if stats["samples"]
+        }
+        if fields:
+            await redis.hset(STATS_KEY, mapping=fields)
+
+    async def run(self) -> None:
+        """Saves the stats every PERSIST_INTERVAL seconds."""
+        while True:
+            await asyncio.sleep(PERSIST_INTERVAL)
+            try:
+                await self.save()
+            except Exception as e:
+                print(f"Error saving provider stats: {e}")
+
+provider_stats = ProviderStatsRegistry()
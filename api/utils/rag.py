@@ -5,6 +5,8 @@ from curl_cffi.requests import AsyncSession
 from bs4 import BeautifulSoup
 import PyPDF2
 import csv
+
+from api.utils.http import http_clients
 class ContentExtractor:
     """
     Class to extract content from various file types given their URLs.
@@ -75,7 +77,7 @@ class MessageProcessor:
         self.content_extractor = ContentExtractor()
     async def process_messages(self, messages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
         """Process messages and extract content from URLs"""
-        session = AsyncSession(impersonate="chrome107")
+        session = http_clients.curl_session("rag")
         processed_messages = []
         
         for message in messages:
@@ -104,7 +106,6 @@ class MessageProcessor:
                 })
             else:
                 processed_messages.append(message)
-        await session.close()
         return processed_messages
     
 rag_system = MessageProcessor()
\ No newline at end of file
@@ -1,9 +1,12 @@
-from typing import Callable, Any, Optional, Tuple
+from typing import Callable, Coroutine, Any, Optional, Tuple
 import hashlib
 import asyncio
+import math
+import uuid
 
-from redis_rate_limit import RateLimit, TooManyRequests
-from redis import ConnectionPool, Redis
+from redis.asyncio import ConnectionPool, Redis
+from redis.commands.core import AsyncScript
+from redis.exceptions import NoScriptError
 import ujson
 import yaml
 
@@ -11,51 +14,179 @@ import yaml
 with open("secrets/values.yml") as f:
     config = yaml.safe_load(f)["redis"]
 
+# one pool shared by every module that talks to redis
 redis_pool = ConnectionPool(
     host=config['host'],
     port=config['port'],
     password=config['password'],
+    max_connections=config.get('max_connections', 100),
     decode_responses=True
 )
 redis = Redis(connection_pool=redis_pool)
 
 
+RATE_LIMIT_WINDOW = 60 # seconds
+
+# sliding window log, KEYS[1] = sorted set of request times, ARGV = window (seconds), limit, member
+# uses the Redis clock so every worker agrees on the window
+# returns {allowed, remaining, microseconds until the oldest request leaves the window}
+RATE_LIMIT_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000000 + tonumber(time[2])
+local window = tonumber(ARGV[1]) * 1000000
+local limit = tonumber(ARGV[2])
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local count = redis.call('ZCARD', KEYS[1])
+local allowed = 0
+if count < limit then
+    redis.call('ZADD', KEYS[1], now, ARGV[3])
+    count = count + 1
+    allowed = 1
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+
+local reset = 0
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+if oldest[2] then
+    reset = tonumber(oldest[2]) + window - now
+end
+return {allowed, math.max(limit - count, 0), reset}
+"""
+rate_limit_script = redis.register_script(RATE_LIMIT_SCRIPT)
+
 class RateLimited(Exception):
     """Custom exception for rate limiting"""
-    def __init__(self, error: str):
+    def __init__(self, error: str, retry_after: int = 0):
         super().__init__(error)
         self.error: str = error
+        self.retry_after: int = retry_after
+
+async def load_scripts(*scripts: AsyncScript) -> None:
+    """Loads Lua scripts into Redis ahead of time, so pipelines can run them with EVALSHA."""
+    for script in scripts:
+        try:
+            await redis.script_load(script.script)
+        except Exception as e:
+            print(f"Error loading redis script: {e}")
+
+class RequestPipeline:
+    """Sends the Redis commands of a request in one round-trip.
+
+    Commands queued through `script` or `command` wait for the pipeline to execute.
+    Scripts are sent as a plain EVALSHA of the SHA loaded on startup (see load_scripts),
+    a script Redis no longer has is run again on its own, which loads it.
+    `gather` runs coroutines that take this pipeline (check_rate_limit, charge_request,
+    ...) concurrently and executes once they have all queued their commands, so each of
+    them reads like a normal call:
+
+        pipeline = RequestPipeline()
+        (_, remaining, reset), cached = await pipeline.gather(
+            check_rate_limit(key, 10, pipeline=pipeline),
+            pipeline.command("get", cache_key)
+        )
+    """
+    def __init__(self):
+        self.pipe = redis.pipeline(transaction=False)
+        self._futures: list[tuple[asyncio.Future, tuple | None]] = []  # (future, (script, keys, args) to retry on NOSCRIPT)
+        self._queued = asyncio.Event()
+
+    async def script(self, script: AsyncScript, keys: list, args: list) -> Any:
+        # not through the Script object, that makes the pipeline send SCRIPT EXISTS first
+        await self.pipe.evalsha(script.sha, len(keys), *keys, *args)
+        return await self._wait((script, keys, args))
+
+    async def command(self, name: str, *args, **kwargs) -> Any:
+        await getattr(self.pipe, name)(*args, **kwargs)
+        return await self._wait()
+
+    async def _wait(self, fallback: tuple | None = None) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        self._futures.append((future, fallback))
+        self._queued.set()
+        return await future
+
+    async def execute(self) -> None:
+        """Sends every queued command and resolves the waiting callers."""
+        futures, self._futures = self._futures, []
+        self._queued.clear()
+        if not futures:
+            return
+
+        try:
+            results = await self.pipe.execute(raise_on_error=False)
+        except Exception as e:
+            for future, _ in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (future, fallback), result in zip(futures, results):
+            if future.done():
+                continue
+            if isinstance(result, NoScriptError) and fallback is not None:
+                # the script cache was flushed, EVAL it once on its own
+                script, keys, args = fallback
+                try:
+                    future.set_result(await script(keys=keys, args=args))
+                except Exception as e:
+                    future.set_exception(e)
+            elif isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def gather(self, *coroutines: Coroutine, return_exceptions: bool = False) -> list:
+        """Runs `coroutines` concurrently, executing the pipeline whenever they are all waiting on it."""
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+        try:
+            while not all(task.done() for task in tasks):
+                await asyncio.sleep(0) # let every task run up to its next queued command
+                if self._futures:
+                    await self.execute()
+                    continue
+
+                # some task is waiting on something else, wake up when it queues or finishes
+                queued = asyncio.ensure_future(self._queued.wait())
+                await asyncio.wait([task for task in tasks if not task.done()] + [queued], return_when=asyncio.FIRST_COMPLETED)
+                queued.cancel()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        return await asyncio.gather(*tasks, return_exceptions=return_exceptions)
 
 def generate_cache_key(json_data):
     return hashlib.sha256(ujson.dumps(json_data, sort_keys=True).encode()).hexdigest()
 
-async def check_rate_limit(api_key: str, max_requests: int = 10) -> Tuple[bool, int]:
+async def check_rate_limit(api_key: str, max_requests: int = 10, pipeline: RequestPipeline | None = None) -> Tuple[bool, int, int]:
     """
-    Check rate limit for an API key.
+    Check rate limit for an API key, in a single round-trip.
 
     Args:
         api_key (str): API key to check
         max_requests (int): Maximum requests allowed per minute (default: 10)
+        pipeline (RequestPipeline | None): Send the check as part of this pipeline
     
     Returns:
-        Tuple[bool, int]: (is_allowed, seconds_to_wait)
-        - is_allowed: True if within rate limit, False if exceeded
-        - seconds_to_wait: Seconds until next request allowed (0 if allowed)
+        Tuple[bool, int, int]: (is_allowed, remaining, seconds_to_reset)
+        - is_allowed: always True, exceeding the limit raises RateLimited
+        - remaining: Requests left in the current window
+        - seconds_to_reset: Seconds until the oldest request leaves the window
+
+    Raises:
+        RateLimited: The limit was exceeded, `retry_after` holds the seconds to wait.
     """
-    rate_limit = RateLimit(
-        resource="rate_limit", 
-        client=api_key, 
-        redis_pool=redis_pool,
-        max_requests=max_requests,
-        expire=60
-    )
-    
-    try:
-        with rate_limit:
-            return True, 0
-    except TooManyRequests:
-        wait_time = await asyncio.to_thread(rate_limit.get_wait_time)
-        raise RateLimited(f"You have exceeded the rate limit of {max_requests} a minute, please wait {wait_time} seconds or purchase a higher plan.")
+    keys, args = [f"rate_limit:{api_key}"], [RATE_LIMIT_WINDOW, max_requests, uuid.uuid4().hex]
+    if pipeline is not None:
+        allowed, remaining, reset = await pipeline.script(rate_limit_script, keys, args)
+    else:
+        allowed, remaining, reset = await rate_limit_script(keys=keys, args=args)
+    reset = math.ceil(int(reset) / 1_000_000)
+
+    if not allowed:
+        raise RateLimited(f"You have exceeded the rate limit of {max_requests} a minute, please wait {reset} seconds or purchase a higher plan.", retry_after=reset)
+    return True, int(remaining), reset
     
 async def get_or_set_cache(
     cache_key: str, 
@@ -72,7 +203,6 @@ async def get_or_set_cache(
         key (str): The unique identifier for the cached value in Redis.
         function (Callable[..., Any]): The function to call if the value is not 
             in the cache. The result of this function will be cached.
-        ttl (int): Time-to-live in seconds for the cached value (default is 60).
         *args: Additional positional arguments to pass to `function`.
         **kwargs: Additional keyword arguments to pass to `function`.
 
@@ -86,7 +216,7 @@ async def get_or_set_cache(
     if not cache_key:
         raise ValueError("Cache key cannot be empty or None")
     
-    cached_value = await asyncio.to_thread(redis.get, cache_key)
+    cached_value = await redis.get(cache_key)
     
     if cached_value:
         return ujson.loads(cached_value)
@@ -95,7 +225,7 @@ async def get_or_set_cache(
     
     try:
         if value is not None:
-            await asyncio.to_thread(redis.set, cache_key, ujson.dumps(value))
+            await redis.set(cache_key, ujson.dumps(value))
         
         return value
     except:
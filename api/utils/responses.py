@@ -7,9 +7,37 @@ from fastapi import HTTPException
 import ujson
 import time
 
+from api.utils.provider_stats import ProviderCall, current_call, stream_capture
 from api.utils.logging import print_status, log_and_return_error_id
 from api.database import DatabaseManager, ModelManager
 from api.utils.tokenizer import get_output_count
+from api.config import config
+
+STREAM_FAILOVER: bool = getattr(config, 'stream_failover', False)  # resume broken streams on another provider
+FAILOVER_ATTEMPTS: int = getattr(config, 'stream_failover_attempts', 2)
+
+async def _empty_stream() -> AsyncIterator[str]:
+    return
+    yield
+
+def _tracked(stream: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Keeps the provider call `generate` is making open until `stream` is consumed."""
+    call = current_call.get()
+    if call is None:
+        return stream
+    call.streaming = True
+    return _finish_after(stream, call)
+
+async def _finish_after(stream: AsyncIterator[str], call: ProviderCall) -> AsyncIterator[str]:
+    try:
+        async for chunk in stream:
+            call.first_token()
+            yield chunk
+    except Exception:
+        call.finish(error=True)
+        raise
+    finally:
+        call.finish()
 
 class ResponseGenerator:
     """A helper class to generate various types of API responses."""
@@ -114,26 +142,70 @@ class ResponseGenerator:
             await self.update_token_usage_stream([str(tool_call_data)], model, key)
             await print_status(True, round(time.time() - start_time, 2), model, user, str(tool_call_data))
 
-    async def stream_response_iterator_str_generator(
+    def stream_response_iterator_str_generator(
         self,
         message: AsyncIterator[str],
         model: str,
         key: str,
         start_time: float,
         user: str
+    ) -> AsyncIterator[str]:
+        # not a generator itself, so the provider call is captured while `generate` runs
+        call = current_call.get()
+        if call is not None:
+            call.streaming = True
+
+        # a failover continues the stream of the request that broke, it gets the raw stream
+        capture = stream_capture.get()
+        if capture is not None:
+            capture.append((message, call))
+            return _empty_stream()
+        return self._stream_response_iterator_str_generator(message, model, key, start_time, user, call)
+
+    async def _stream_response_iterator_str_generator(
+        self,
+        message: AsyncIterator[str],
+        model: str,
+        key: str,
+        start_time: float,
+        user: str,
+        call: ProviderCall | None = None
     ) -> AsyncIterator[str]:
         content_history: List[str] = []
+        attempts = 0
 
         yield self.create_initial_response(model)
 
         try:
-            async for obj in message:
-                yield self.create_content_chunk(obj, model)
-                content_history.append(obj)
-        except Exception as e:
-            error_response = await self.create_error_response(str(e))
-            await print_status(False, round(time.time() - start_time, 2), model, user, ''.join(content_history))
-            yield error_response
+            while True:
+                try:
+                    async for obj in message:
+                        if call is not None:
+                            call.first_token()
+                        yield self.create_content_chunk(obj, model)
+                        content_history.append(obj)
+                    break
+                except Exception as e:
+                    if call is not None:
+                        call.finish(error=True)
+
+                    # continue on another provider from what the client already got
+                    resumed = None
+                    if STREAM_FAILOVER and attempts < FAILOVER_ATTEMPTS and call is not None and call.failover is not None:
+                        attempts += 1
+                        resumed = await call.failover(''.join(content_history))
+                    if resumed is not None:
+                        message, call = resumed
+                        continue
+
+                    error_response = await self.create_error_response(str(e))
+                    await print_status(False, round(time.time() - start_time, 2), model, user, ''.join(content_history))
+                    yield error_response
+                    break
+        finally:
+            # also covers clients that disconnect mid stream
+            if call is not None:
+                call.finish()
     
         yield self.create_final_response(model)
         yield "data: [DONE]"
@@ -335,12 +407,14 @@ def generate_call_id():
 async def update_token_usage_stream(data: list, model: str, key: str):
   await response_generator.update_token_usage_stream(data, model, key)
 
-async def stream_response_iterator_str(message: str, model: str, key: str):
-    async for chunk in response_generator.stream_response_iterator_str(message, model, key):
-        yield chunk
+def stream_response_iterator_str(message: str, model: str, key: str) -> AsyncIterator[str]:
+    return _tracked(response_generator.stream_response_iterator_str(message, model, key))
 
 # deprecated, use stream_response_iterator_str / stream_response_iterator_str_generator instead
-async def stream_response_iterator(message, model: str, key: str, start_time: float, user: str):
+def stream_response_iterator(message, model: str, key: str, start_time: float, user: str) -> AsyncIterator[str]:
+    return _tracked(_stream_response_iterator(message, model, key, start_time, user, current_call.get()))
+
+async def _stream_response_iterator(message, model: str, key: str, start_time: float, user: str, call: ProviderCall | None = None):
     content_history: list = []
 
     try:
@@ -368,6 +442,8 @@ async def stream_response_iterator(message, model: str, key: str, start_time: fl
                 except:
                     pass
     except Exception as e:
+        if call is not None:
+            call.finish(error=True)
         async for error_chunk in response_generator.stream_error_response(str(e)):
             yield error_chunk
     finally:
@@ -376,25 +452,23 @@ async def stream_response_iterator(message, model: str, key: str, start_time: fl
         await response_generator.update_token_usage_stream(content_history, model, key)
         await print_status(True, round(time.time() - start_time, 2), model, user, ''.join(content_history))
 
-async def stream_response_iterator_str_generator(
+def stream_response_iterator_str_generator(
     message: AsyncIterator[str],
     model: str,
     key: str,
     start_time: float,
     user: str
 ) -> AsyncIterator[str]:
-    async for chunk in response_generator.stream_response_iterator_str_generator(message, model, key, start_time, user):
-        yield chunk
+    return response_generator.stream_response_iterator_str_generator(message, model, key, start_time, user)
 
-async def stream_response_iterator_tool(
+def stream_response_iterator_tool(
     tool_call_data: List[Dict[str, Any]],
     model: str,
     key: str,
     start_time: float,
     user: str
 ) -> AsyncIterator[str]:
-     async for chunk in response_generator.stream_response_iterator_tool(tool_call_data, model, key, start_time, user):
-         yield chunk
+    return _tracked(response_generator.stream_response_iterator_tool(tool_call_data, model, key, start_time, user))
 
 async def stream_error_response(error: str) -> AsyncIterator[str]:
     yield await response_generator.create_error_response(error)
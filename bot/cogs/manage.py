@@ -4,11 +4,11 @@ from typing import Dict, Any, List
 from nextcord import ui, ButtonStyle, Color, Embed, Interaction, Member, Permissions
 from nextcord.ext import commands
 import nextcord
-import aiohttp
 
 import sys
 sys.path.append("..")
 from api.config import bot_data
+from api.utils.http import http_clients
 
 @dataclass
 class BotData:
@@ -37,10 +37,9 @@ class APIClient:
         self.headers = headers
 
     async def _make_request(self, endpoint: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(endpoint, headers=self.headers, json=payload) as response:
-                response.raise_for_status()
-                return await response.json()
+        async with http_clients.session("admin_api").post(endpoint, headers=self.headers, json=payload) as response:
+            response.raise_for_status()
+            return await response.json()
 
     async def check_key(self, user_id: int) -> Dict[str, Any]:
         return await self._make_request(APIEndpoints.CHECK, {"id": str(user_id)})
@@ -474,6 +473,9 @@ class ManageDashboardAdmin(commands.Cog):
         self.bot_data = bot_data
         self.api_client = APIClient(HEADERS)
 
+    def cog_unload(self) -> None:
+        self.bot.loop.create_task(http_clients.close_session("admin_api"))
+
     def get_banner_embed(self, user_name: str = None) -> Embed:
         embed = Embed(color=Color(BRAND_COLOR))
         if user_name: